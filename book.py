@@ -0,0 +1,147 @@
+#Opening book: a file of (position key, move, weight) records sorted by key,
+#looked up by binary search over the memory-mapped file, so the computer
+#plays the first moves of the game instantly and not always the same way.
+#
+#Each record is 12 bytes, big-endian: the engine's Zobrist key (8), the
+#packed move (2) and its weight (2). Keys come from engine.ZOBRIST_*, so the
+#book has to be rebuilt if those tables ever change.
+#
+#    python book.py                  rebuild book.bin from OPENING_LINES
+#    python book.py --fen "<fen>"    list the book moves for a position
+
+import argparse
+import mmap
+import os
+import random
+import struct
+
+import engine
+
+RECORD = struct.Struct('>QHH')
+
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.bin')
+
+#main lines of common openings in coordinate notation; a move's weight is
+#the number of lines that play it from that position
+OPENING_LINES = (
+    'e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1 b7b5 a4b3 d7d6',
+    'e2e4 e7e5 g1f3 b8c6 f1b5 g8f6 e1g1 f6e4 d2d4 e4d6 b5c6 d7c6 d4e5 d6f5',
+    'e2e4 e7e5 g1f3 b8c6 f1c4 f8c5 c2c3 g8f6 d2d3 d7d6 e1g1 e8g8',
+    'e2e4 e7e5 g1f3 b8c6 f1c4 g8f6 d2d3 f8e7 e1g1 e8g8 f1e1 d7d6',
+    'e2e4 e7e5 g1f3 b8c6 d2d4 e5d4 f3d4 g8f6 d4c6 b7c6 e4e5 d8e7',
+    'e2e4 e7e5 g1f3 g8f6 f3e5 d7d6 e5f3 f6e4 d2d4 d6d5 f1d3 b8c6',
+    'e2e4 e7e5 b1c3 g8f6 f2f4 d7d5 f4e5 f6e4 g1f3 f8e7',
+    'e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 a7a6 c1e3 e7e5 d4b3 c8e6',
+    'e2e4 c7c5 g1f3 d7d6 d2d4 c5d4 f3d4 g8f6 b1c3 g7g6 c1e3 f8g7 f2f3 e8g8',
+    'e2e4 c7c5 g1f3 b8c6 d2d4 c5d4 f3d4 g8f6 b1c3 e7e5 d4b5 d7d6 c1g5 a7a6',
+    'e2e4 c7c5 g1f3 e7e6 d2d4 c5d4 f3d4 b8c6 b1c3 d8c7 c1e3 a7a6',
+    'e2e4 c7c5 c2c3 g8f6 e4e5 f6d5 d2d4 c5d4 g1f3 b8c6',
+    'e2e4 e7e6 d2d4 d7d5 b1c3 g8f6 c1g5 f8e7 e4e5 f6d7 g5e7 d8e7',
+    'e2e4 e7e6 d2d4 d7d5 b1d2 g8f6 e4e5 f6d7 f1d3 c7c5 c2c3 b8c6',
+    'e2e4 e7e6 d2d4 d7d5 e4e5 c7c5 c2c3 b8c6 g1f3 d8b6 a2a3 c5c4',
+    'e2e4 c7c6 d2d4 d7d5 b1c3 d5e4 c3e4 c8f5 e4g3 f5g6 h2h4 h7h6',
+    'e2e4 c7c6 d2d4 d7d5 e4e5 c8f5 g1f3 e7e6 f1e2 c6c5 c1e3 b8d7',
+    'e2e4 d7d5 e4d5 d8d5 b1c3 d5a5 d2d4 g8f6 g1f3 c8f5',
+    'e2e4 d7d6 d2d4 g8f6 b1c3 g7g6 g1f3 f8g7 f1e2 e8g8 e1g1 c7c6',
+    'd2d4 d7d5 c2c4 e7e6 b1c3 g8f6 c1g5 f8e7 e2e3 e8g8 g1f3 h7h6',
+    'd2d4 d7d5 c2c4 c7c6 g1f3 g8f6 b1c3 d5c4 a2a4 c8f5 e2e3 e7e6',
+    'd2d4 d7d5 c2c4 d5c4 g1f3 g8f6 e2e3 e7e6 f1c4 c7c5 e1g1 a7a6',
+    'd2d4 g8f6 c2c4 e7e6 b1c3 f8b4 e2e3 e8g8 f1d3 d7d5 g1f3 c7c5',
+    'd2d4 g8f6 c2c4 e7e6 g1f3 b7b6 g2g3 c8a6 b2b3 f8b4 c1d2 b4e7',
+    'd2d4 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 d7d6 g1f3 e8g8 f1e2 e7e5',
+    'd2d4 g8f6 c2c4 g7g6 b1c3 d7d5 c4d5 f6d5 e2e4 d5c3 b2c3 f8g7',
+    'd2d4 g8f6 c2c4 c7c5 d4d5 e7e6 b1c3 e6d5 c4d5 d7d6 e2e4 g7g6',
+    'd2d4 g8f6 g1f3 d7d5 c1f4 e7e6 e2e3 c7c5 c2c3 b8c6 b1d2 f8d6',
+    'd2d4 f7f5 g2g3 g8f6 f1g2 g7g6 g1f3 f8g7 e1g1 e8g8 c2c4 d7d6',
+    'c2c4 e7e5 b1c3 g8f6 g1f3 b8c6 g2g3 d7d5 c4d5 f6d5 f1g2 d5b6',
+    'c2c4 c7c5 b1c3 b8c6 g2g3 g7g6 f1g2 f8g7 g1f3 e7e6 e1g1 g8e7',
+    'c2c4 g8f6 b1c3 e7e6 e2e4 d7d5 e4e5 d5d4 e5f6 d4c3 b2c3 d8f6',
+    'g1f3 d7d5 g2g3 g8f6 f1g2 g7g6 e1g1 f8g7 d2d3 e8g8 b1d2 c7c5',
+    'g1f3 g8f6 c2c4 g7g6 b1c3 f8g7 e2e4 d7d6 d2d4 e8g8 f1e2 e7e5',
+)
+
+def buildBook(lines=OPENING_LINES, path=BOOK_PATH):
+    """Play out the lines, count each (position, move) and write the book.
+    Returns the number of records written."""
+    weights = {}
+    for line in lines:
+        position = engine.positionFromFen(engine.START_FEN)
+        for name in line.split():
+            moves = [move for move in position.legalMoves() if engine.moveName(move) == name]
+            if not moves:
+                raise ValueError(f'illegal move {name} in line: {line}')
+            entry = (position.key, moves[0])
+            weights[entry] = weights.get(entry, 0) + 1
+            position.make(moves[0])
+    with open(path, 'wb') as file:
+        for (key, move), weight in sorted(weights.items()):
+            file.write(RECORD.pack(key, move, min(weight, 0xffff)))
+    return len(weights)
+
+class OpeningBook:
+    """A book file opened read-only and memory-mapped."""
+    def __init__(self, path=BOOK_PATH):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.data) // RECORD.size
+        self.random = random.Random()
+
+    def lookup(self, key):
+        """All (move, weight) pairs stored for the position key."""
+        # Find the first record with this key, then read the run of them
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if RECORD.unpack_from(self.data, middle * RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        while low < self.size:
+            recordKey, move, weight = RECORD.unpack_from(self.data, low * RECORD.size)
+            if recordKey != key:
+                break
+            entries.append((move, weight))
+            low += 1
+        return entries
+
+    def chooseMove(self, position):
+        """A book move for the position picked at random by weight, or None
+        when the position isn't in the book."""
+        legal = position.legalMoves()
+        # A key collision could suggest a move that isn't legal here
+        entries = [(move, weight) for move, weight in self.lookup(position.key)
+                   if move in legal]
+        if not entries:
+            return None
+        pick = self.random.randrange(sum(weight for move, weight in entries))
+        for move, weight in entries:
+            pick -= weight
+            if pick < 0:
+                return move
+
+#the book file is opened on first use
+book = None
+
+def bookMove(position):
+    """A book move for the position, or None (also when there is no book file)."""
+    global book
+    if book is None:
+        if not os.path.exists(BOOK_PATH):
+            return None
+        book = OpeningBook()
+    return book.chooseMove(position)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the opening book')
+    parser.add_argument('--fen', help='list the book moves for this position')
+    args = parser.parse_args()
+    if args.fen:
+        position = engine.positionFromFen(args.fen)
+        for move, weight in OpeningBook().lookup(position.key):
+            print(engine.moveName(move), weight)
+    else:
+        print(f'{buildBook()} positions and moves written to {BOOK_PATH}')
+
+if __name__ == '__main__':
+    main()
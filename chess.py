@@ -1,9 +1,12 @@
 import math, copy, time
-import random as random_module
 from PIL import Image as PILImage
 import pygame
 import os
 import sys
+import book
+import engine
+import search
+import tablebase
 
 # Initialize pygame
 pygame.init()
@@ -181,260 +184,57 @@ def drawImage(path, x, y, width=None, height=None, align='center'):
 
 # AI Functions
 
-def evaluatePosition(app):
-    """Evaluate the current position. Positive favors white, negative favors black."""
-    value = 0
-    
-    # Material values only (fast evaluation, no expensive checks)
-    pieceValues = {pawn: 1, knight: 3, bishop: 3, rook: 5, queen: 9, king: 0}
-    
-    for piece in app.whitepieces:
-        value += pieceValues[type(piece)]
-    
-    for piece in app.blackpieces:
-        value -= pieceValues[type(piece)]
-    
-    return value
+# The search itself lives in search.py and only ever sees an engine Position
 
 def getAllValidMoves(app, color):
-    """Get all valid moves for a given color."""
-    pieces = app.whitepieces if color == 'white' else app.blackpieces
-    allMoves = []
-    
-    for i, piece in enumerate(pieces):
-        possibleMoves = piece.moves(app.plist)
-        # Set prevclick temporarily to use actualMoves function
-        originalPrevclick = app.prevclick
-        app.prevclick = [piece.row, piece.col]
-        validMoves = actualMoves(app, possibleMoves)
-        app.prevclick = originalPrevclick
-        
-        for move in validMoves:
-            allMoves.append((piece, move))
-    
-    return allMoves
-
-def makeMove(app, piece, move):
-    """Make a move and return the captured piece (if any) for undo."""
-    capturedPiece = app.plist[move[0]][move[1]]
-    
-    # Store original position
-    originalRow, originalCol = piece.row, piece.col
-    
-    # Handle special moves (similar to mousePressed logic)
-    if len(move) > 2:
-        if move[2] == 'hit':
-            if piece.color == 'white':
-                app.whitetakenpieces.append(capturedPiece)
-                app.blackpieces.remove(capturedPiece)
-            else:
-                app.blacktakenpieces.append(capturedPiece)
-                app.whitepieces.remove(capturedPiece)
-        # Handle castling, en passant, etc. (simplified for AI)
-    
-    # Move the piece
-    app.plist[originalRow][originalCol] = None
-    app.plist[move[0]][move[1]] = piece
-    piece.row = move[0]
-    piece.col = move[1]
-    
-    return capturedPiece, originalRow, originalCol
-
-def undoAIMove(app, piece, move, capturedPiece, originalRow, originalCol):
-    """Undo a move (used by AI for move evaluation)."""
-    # Move piece back
-    app.plist[move[0]][move[1]] = capturedPiece
-    app.plist[originalRow][originalCol] = piece
-    piece.row = originalRow
-    piece.col = originalCol
-    
-    # Restore captured piece
-    if capturedPiece is not None and len(move) > 2 and move[2] == 'hit':
-        if piece.color == 'white':
-            app.whitetakenpieces.remove(capturedPiece)
-            app.blackpieces.append(capturedPiece)
-        else:
-            app.blacktakenpieces.remove(capturedPiece)
-            app.whitepieces.append(capturedPiece)
-
-def easyAI(app):
-    """Easy AI: Basic capture preference with simple evaluation."""
-    validMoves = getAllValidMoves(app, app.computerPlayer)
-    if not validMoves:
-        return None
-    
-    # Prefer captures, but not always - adds some evaluation
-    captures = []
-    for piece, move in validMoves:
-        if len(move) > 2 and move[2] == 'hit':
-            pieceValues = {pawn: 1, knight: 3, bishop: 3, rook: 5, queen: 9}
-            captured = app.plist[move[0]][move[1]]
-            if captured:
-                captureValue = pieceValues.get(type(captured), 0)
-                captures.append((captureValue, piece, move))
-    
-    # 70% chance to take a capture if available, otherwise random
-    if captures and random_module.random() < 0.7:
-        captures.sort(reverse=True, key=lambda x: x[0])
-        return captures[0][1:]  # Return (piece, move)
-    
-    return random_module.choice(validMoves)
+    """Get all valid moves for a given color as packed engine moves."""
+    return engine.legalMoves(app.position, engine.colorIndex(color))
 
-def mediumAI(app):
-    """Medium AI: Minimax depth 1, evaluates top moves."""
-    validMoves = getAllValidMoves(app, app.computerPlayer)
-    if not validMoves:
-        return None
-    
-    # Evaluate moves with depth 1 minimax
-    bestMove = None
-    bestValue = float('-inf') if app.computerPlayer == 'white' else float('inf')
-    
-    # Order moves: captures first for better pruning
-    moveScores = []
-    for piece, move in validMoves:
-        score = 0
-        if len(move) > 2 and move[2] == 'hit':
-            pieceValues = {pawn: 1, knight: 3, bishop: 3, rook: 5, queen: 9}
-            captured = app.plist[move[0]][move[1]]
-            if captured:
-                score = pieceValues.get(type(captured), 0) * 10
-        moveScores.append((score, piece, move))
-    moveScores.sort(reverse=True, key=lambda x: x[0])
-    orderedMoves = [m[1:] for m in moveScores]
-    
-    # Evaluate top 20 moves (more than before for better play)
-    movesToEvaluate = orderedMoves[:min(20, len(orderedMoves))]
-    
-    for piece, move in movesToEvaluate:
-        captured, origRow, origCol = makeMove(app, piece, move)
-        
-        # Use minimax with depth 1
-        value = minimax(app, 1, app.computerPlayer == 'black', float('-inf'), float('inf'))
-        
-        undoAIMove(app, piece, move, captured, origRow, origCol)
-        
-        if app.computerPlayer == 'white':
-            if value > bestValue:
-                bestValue = value
-                bestMove = (piece, move)
-        else:
-            if value < bestValue:
-                bestValue = value
-                bestMove = (piece, move)
-    
-    return bestMove if bestMove else random_module.choice(validMoves)
-
-def minimax(app, depth, isMaximizing, alpha, beta):
-    """Minimax algorithm with alpha-beta pruning and move ordering."""
-    if depth == 0:
-        return evaluatePosition(app)
-    
-    color = 'white' if isMaximizing else 'black'
-    validMoves = getAllValidMoves(app, color)
-    
-    if not validMoves:
-        # Check if it's checkmate or stalemate
-        king = app.whiteking if color == 'white' else app.blackking
-        if inCheck(app, king.row, king.col, color):
-            return -1000 if isMaximizing else 1000  # Checkmate
-        else:
-            return 0  # Stalemate
-    
-    # Order moves: captures first for better alpha-beta pruning
-    moveScores = []
-    for piece, move in validMoves:
-        score = 0
-        if len(move) > 2 and move[2] == 'hit':
-            pieceValues = {pawn: 1, knight: 3, bishop: 3, rook: 5, queen: 9}
-            captured = app.plist[move[0]][move[1]]
-            if captured:
-                score = pieceValues.get(type(captured), 0) * 10
-        moveScores.append((score, piece, move))
-    moveScores.sort(reverse=True, key=lambda x: x[0])
-    orderedMoves = [m[1:] for m in moveScores]
-    
-    if isMaximizing:
-        maxEval = float('-inf')
-        for piece, move in orderedMoves:
-            captured, origRow, origCol = makeMove(app, piece, move)
-            eval = minimax(app, depth - 1, False, alpha, beta)
-            undoAIMove(app, piece, move, captured, origRow, origCol)
-            
-            maxEval = max(maxEval, eval)
-            alpha = max(alpha, eval)
-            if beta <= alpha:
-                break  # Alpha-beta pruning
-        return maxEval
-    else:
-        minEval = float('inf')
-        for piece, move in orderedMoves:
-            captured, origRow, origCol = makeMove(app, piece, move)
-            eval = minimax(app, depth - 1, True, alpha, beta)
-            undoAIMove(app, piece, move, captured, origRow, origCol)
-            
-            minEval = min(minEval, eval)
-            beta = min(beta, eval)
-            if beta <= alpha:
-                break  # Alpha-beta pruning
-        return minEval
-
-def hardAI(app):
-    """Hard AI: Minimax with depth 3, evaluates many moves."""
-    validMoves = getAllValidMoves(app, app.computerPlayer)
-    if not validMoves:
-        return None
-    
-    # Order moves: captures first, then by piece value
-    moveScores = []
-    for piece, move in validMoves:
-        score = 0
-        if len(move) > 2 and move[2] == 'hit':
-            pieceValues = {pawn: 1, knight: 3, bishop: 3, rook: 5, queen: 9}
-            captured = app.plist[move[0]][move[1]]
-            if captured:
-                score = pieceValues.get(type(captured), 0) * 10
-        # Add piece value for move ordering
-        pieceValues = {pawn: 1, knight: 3, bishop: 3, rook: 5, queen: 9, king: 0}
-        score += pieceValues.get(type(piece), 0)
-        moveScores.append((score, piece, move))
-    moveScores.sort(reverse=True, key=lambda x: x[0])
-    orderedMoves = [m[1:] for m in moveScores]
-    
-    # Evaluate top 25 moves with depth 3 (much deeper search)
-    movesToEvaluate = orderedMoves[:min(25, len(orderedMoves))]
-    
-    bestMove = None
-    bestValue = float('-inf') if app.computerPlayer == 'white' else float('inf')
-    
-    for piece, move in movesToEvaluate:
-        captured, origRow, origCol = makeMove(app, piece, move)
-        
-        # Use minimax with depth 3 (deeper search for stronger play)
-        value = minimax(app, 3, app.computerPlayer == 'black', float('-inf'), float('inf'))
-        
-        undoAIMove(app, piece, move, captured, origRow, origCol)
-        
-        if app.computerPlayer == 'white':
-            if value > bestValue:
-                bestValue = value
-                bestMove = (piece, move)
-        else:
-            if value < bestValue:
-                bestValue = value
-                bestMove = (piece, move)
-    
-    return bestMove if bestMove else orderedMoves[0]
+def uiMove(app, move):
+    """Convert a packed move to the (piece, (row, col[, tag])) pair the UI uses."""
+    fromSq = move & 63
+    return app.plist[fromSq // 8][fromSq % 8], engine.toUIMove(move)
 
 def getComputerMove(app):
-    """Get the computer's move based on difficulty."""
-    if app.difficulty == 'easy':
-        return easyAI(app)
-    elif app.difficulty == 'medium':
-        return mediumAI(app)
-    elif app.difficulty == 'hard':
-        return hardAI(app)
-    return None
+    """Get the computer's move based on difficulty, as (piece, move, piece
+    type a promotion makes)."""
+    # Known opening positions are played straight from the book, and
+    # endings with few pieces left straight from the tablebases
+    move = book.bookMove(app.position)
+    app.searchInfo = ['Book move']
+    if move is None:
+        move = tablebase.tablebaseMove(app.position)
+        app.searchInfo = ['Tablebase move']
+    if move is None:
+        # Search a copy so the game position is never touched mid-search
+        move = search.chooseMove(app.position.copy(), app.difficulty)
+        app.searchInfo = searchSummary(search.stats.report())
+    if move is None:
+        return None
+    # Tuples are only produced here, at the boundary with the UI
+    piece, uimove = uiMove(app, move)
+    flag = move >> 12
+    promoteTo = engine.KNIGHT + (flag & 3) if flag & engine.PROMOTION else engine.QUEEN
+    return piece, uimove, promoteTo
+
+def searchSummary(report):
+    """The search stats report as the two lines of the overlay."""
+    first = (f"depth {report['depth']}  {report['nodes']} nodes "
+             f"({report['qnodes']} quiescence)  {report['ms']:.0f} ms")
+    if report['ponderMs']:
+        first += f" (+{report['ponderMs']:.0f} pondering)"
+    # No rate for a search too quick for the clock
+    if report['nps'] is not None:
+        first += f"  {report['nps']} nps"
+    second = []
+    if report['ttProbes']:
+        second.append(f"TT hits {report['ttHits'] * 100 // report['ttProbes']}%")
+    if report['cutoffs']:
+        second.append(f"{report['cutoffs']} cutoffs, "
+                      f"{report['firstMoveCutoffRate']:.0%} on the first move")
+    if report['ebf'] is not None:
+        second.append(f"branching factor {report['ebf']}")
+    return [first, '  '.join(second)]
 
 def gameDimensions():
     rows = 8
@@ -455,6 +255,10 @@ def onAppStart(app):
     app.computerPlayer = 'black'  # which color the computer plays
     app.difficulty = None  # 'easy', 'medium', 'hard'
     app.computerThinking = False
+    app.pondering = True  # search on the human's time too
+    app.searchInfo = None  # overlay lines about the computer's last move
+    # Set CHESS_STATS_LOG to a file name to log every search as JSON lines
+    search.setStatsLog(os.environ.get('CHESS_STATS_LOG'))
     
     #holds the previous click so each player can think and highlight moves
     app.prevclick = None
@@ -507,18 +311,18 @@ def onAppStart(app):
     app.whitepawn6 = pawn('white', 6, 5)
     app.whitepawn7 = pawn('white', 6, 6)
     app.whitepawn8 = pawn('white', 6, 7)
-    app.whitepieces = [app.whiterook1, app.whiterook2, app.whiteknight1, 
+    app.whitepieces = PieceList([app.whiterook1, app.whiterook2, app.whiteknight1, 
         app.whiteknight2, app.whitebishop1, app.whitebishop2, app.whitequeen,
         app.whitepawn1, app.whitepawn2, app.whitepawn3, app.whitepawn4, 
-        app.whitepawn5, app.whitepawn6, app.whitepawn7, app.whitepawn8, app.whiteking]
-    app.blackpieces = [app.blackrook1, app.blackrook2, app.blackknight1, 
+        app.whitepawn5, app.whitepawn6, app.whitepawn7, app.whitepawn8, app.whiteking])
+    app.blackpieces = PieceList([app.blackrook1, app.blackrook2, app.blackknight1, 
         app.blackknight2, app.blackbishop1, app.blackbishop2, app.blackqueen,
         app.blackpawn1, app.blackpawn2, app.blackpawn3, app.blackpawn4, 
-        app.blackpawn5, app.blackpawn6, app.blackpawn7, app.blackpawn8, app.blackking]
+        app.blackpawn5, app.blackpawn6, app.blackpawn7, app.blackpawn8, app.blackking])
     
     #list of the taken pieces for each player, displayed on side of board
-    app.whitetakenpieces = []
-    app.blacktakenpieces = []
+    app.whitetakenpieces = PieceList()
+    app.blacktakenpieces = PieceList()
 
     board = []
     plist = []
@@ -600,8 +404,53 @@ def onAppStart(app):
     app.storePrevious = None
     app.storePreviousType = None
     app.undoList = []
-
+    syncPosition(app)
+
+#piece lists keep every piece in a fixed slot with a piece -> slot index, so
+#capturing a piece and putting it back on undo don't scan the list and the
+#iteration order never changes
+class PieceList():
+    def __init__(self, pieces=()):
+        self.slots = []
+        self.index = {}
+        self.count = 0
+        for piece in pieces:
+            self.append(piece)
+    def append(self, piece):
+        #a piece that was removed goes back into its old slot
+        slot = self.index.get(piece)
+        if slot is None:
+            self.index[piece] = len(self.slots)
+            self.slots.append(piece)
+        else:
+            self.slots[slot] = piece
+        self.count += 1
+    def remove(self, piece):
+        slot = self.index.get(piece)
+        if slot is None or self.slots[slot] is not piece:
+            raise ValueError('piece not in list')
+        self.slots[slot] = None
+        self.count -= 1
+    def replace(self, old, new):
+        #promotion: the new piece takes the pawn's slot
+        slot = self.index[old]
+        self.slots[slot] = new
+        self.index[new] = slot
+    def __contains__(self, piece):
+        slot = self.index.get(piece)
+        return slot is not None and self.slots[slot] is piece
+    def __iter__(self):
+        for piece in self.slots:
+            if piece is not None:
+                yield piece
+    def __len__(self):
+        return self.count
+
+#piece classes hold the UI state of each piece; moves(position) lists the legal
+#moves of the piece from the engine Position. The engine state itself is the
+#slotted engine.Position in app.position
 class piece():
+    __slots__ = ('color', 'row', 'col')
     def __init__(self, color, row, col):
         self.color = color
         self.row = row
@@ -612,8 +461,22 @@ class piece():
         return self.col
     def getColor(self):
         return self.color
+    def moves(self, position):
+        #legal engine moves from this square, as UI tuples; the four
+        #promotions of a pawn share one tuple. Only the side to move has any
+        fromSq = engine.square(self.row, self.col)
+        legalMoves = []
+        if engine.colorIndex(self.color) != position.sideToMove:
+            return legalMoves
+        for move in position.legalMoves():
+            if move & 63 == fromSq:
+                uimove = engine.toUIMove(move)
+                if uimove not in legalMoves:
+                    legalMoves.append(uimove)
+        return legalMoves
 
 class pawn(piece):
+    __slots__ = ('image',)
     def __init__(self, color, row, col):
         self.color = color
         self.row = row
@@ -627,184 +490,25 @@ class pawn(piece):
             if(self.row == 7):
                 return True
         return False
-    def moves(self, board):
-        legalMoves = []
-        if(self.color == 'white'):
-            if(self.row != 0):
-                if(board[self.row-1][self.col] == None):
-                    legalMoves.append((self.row-1, self.col))
-                if(self.row == 6):
-                    if(board[self.row-1][self.col] == None and
-                    board[self.row-2][self.col] == None):
-                        legalMoves.append((self.row-2, self.col))
-                #attack
-                if(self.col != 0):
-                    if(board[self.row-1][self.col-1] != None and
-                    board[self.row-1][self.col-1].getColor()!=self.color):
-                        legalMoves.append((self.row-1, self.col-1, 'hit'))
-                if(self.col != 7):
-                    if(board[self.row-1][self.col+1] != None and
-                    board[self.row-1][self.col+1].getColor()!=self.color):
-                        legalMoves.append((self.row-1, self.col+1, 'hit'))
-                #enpassant
-                if(self.col != 0 and self.row == 3):
-                    if(board[self.row-1][self.col-1] == None and
-                    type(board[self.row][self.col-1]) == pawn and
-                    board[self.row][self.col-1].getColor()!=self.color):
-                        legalMoves.append((self.row-1, self.col-1, 'wlenpassant'))
-                if(self.col != 7 and self.row == 3):
-                    if(board[self.row-1][self.col+1] == None and
-                    type(board[self.row][self.col+1]) == pawn and 
-                    board[self.row][self.col+1].getColor()!=self.color):
-                        legalMoves.append((self.row-1, self.col+1, 'wrenpassant'))
-        
-        else:
-            if(self.row != 7):
-                if(board[self.row+1][self.col] == None):
-                    legalMoves.append((self.row+1, self.col))
-                if(self.row == 1):
-                    if(board[self.row+1][self.col] == None and
-                    board[self.row+2][self.col] == None):
-                        legalMoves.append((self.row+2, self.col))
-                #attack
-                if(self.col != 0):
-                    if(board[self.row+1][self.col-1]!= None and
-                        board[self.row+1][self.col-1].getColor()!=self.color):
-                        legalMoves.append((self.row+1, self.col-1, 'hit'))
-                if(self.col != 7):
-                    if(board[self.row+1][self.col+1]!=None and
-                    board[self.row+1][self.col+1].getColor()!=self.color):
-                        legalMoves.append((self.row+1, self.col+1, 'hit'))
-                #enpassant
-                if(self.col != 0 and self.row == 4):
-                    if(board[self.row+1][self.col-1] == None and
-                    type(board[self.row][self.col-1]) == pawn and
-                    board[self.row][self.col-1].getColor()!=self.color):
-                        legalMoves.append((self.row+1, self.col-1, 'blenpassant'))
-                if(self.col != 7 and self.row == 4):
-                    if(board[self.row+1][self.col+1] == None and
-                    type(board[self.row][self.col+1]) == pawn and 
-                    board[self.row][self.col+1].getColor()!=self.color):
-                        legalMoves.append((self.row+1, self.col+1, 'brenpassant'))
-        return legalMoves
 
 class bishop(piece):
+    __slots__ = ('image',)
     def __init__(self, color, row, col):
         self.color = color
         self.row = row
         self.col = col
         self.image = f'{self.color}bishop.png'
-    def moves(self, board):
-        legalMoves = []
-        #checking upleft
-        if(self.row != 0 and self.col != 0):
-            upleft = 1
-            edgeCase = False
-            while(board[self.row-upleft][self.col-upleft] == None):
-                    legalMoves.append((self.row-upleft, self.col-upleft))
-                    upleft += 1
-                    if(self.col-upleft < 0 or self.row-upleft < 0):
-                        edgeCase = True
-                        break
-            if(not edgeCase and 
-            board[self.row-upleft][self.col-upleft].getColor()!=self.color):
-                legalMoves.append((self.row-upleft, self.col-upleft, 'hit'))
-        #checking upright
-        if(self.row != 0 and self.col != 7):
-            upright = 1
-            edgeCase = False
-            while(board[self.row-upright][self.col+upright] == None):
-                    legalMoves.append((self.row-upright, self.col+upright))
-                    upright += 1
-                    if(self.col+upright > 7 or self.row-upright < 0):
-                        edgeCase = True
-                        break
-            if(not edgeCase and 
-            board[self.row-upright][self.col+upright].getColor()!=
-            self.color):
-                legalMoves.append((self.row-upright, self.col+upright, 'hit'))
-        #checking downleft
-        if(self.row != 7 and self.col != 0):
-            downleft = 1
-            edgeCase = False
-            while(board[self.row+downleft][self.col-downleft] == None):
-                    legalMoves.append((self.row+downleft, self.col-downleft))
-                    downleft += 1
-                    if(self.col-downleft < 0 or self.row+downleft > 7):
-                        edgeCase = True
-                        break
-            if(not edgeCase and 
-            board[self.row+downleft][self.col-downleft].getColor()!=
-            self.color):
-                legalMoves.append((self.row+downleft, self.col-downleft, 'hit'))
-        #checking downright
-        if(self.row != 7 and self.col != 7):
-            downright = 1
-            edgeCase = False
-            while(board[self.row+downright][self.col+downright] == None):
-                    legalMoves.append((self.row+downright, self.col+downright))
-                    downright += 1
-                    if(self.col+downright > 7 or self.row+downright > 7):
-                        edgeCase = True
-                        break
-            if(not edgeCase and board[self.row+
-            downright][self.col+downright].getColor()!=self.color):
-                legalMoves.append((self.row+downright, 
-                self.col+downright, 'hit'))
-        return legalMoves
         
 class knight(piece):
+    __slots__ = ('image',)
     def __init__(self, color, row, col):
         self.color = color
         self.row = row
         self.col = col
         self.image = f'{self.color}knight.png'
-    def moves(self, board):
-        legalMoves = []
-        #all of the knight's moves, 8 in total
-        if(self.row > 1 and self.col > 0):
-            if(board[self.row - 2][self.col - 1] == None):
-                legalMoves.append((self.row - 2, self.col - 1))
-            elif(board[self.row - 2][self.col - 1].getColor()!= self.color):
-                legalMoves.append((self.row - 2, self.col - 1, 'hit'))
-        if(self.row > 1 and self.col < 7):
-            if(board[self.row - 2][self.col + 1] == None):
-                legalMoves.append((self.row - 2, self.col + 1))
-            elif(board[self.row - 2][self.col + 1].getColor()!= self.color):
-                legalMoves.append((self.row - 2, self.col + 1, 'hit'))
-        if(self.row < 6 and self.col > 0):
-            if(board[self.row + 2][self.col - 1] == None):
-                legalMoves.append((self.row + 2, self.col - 1))
-            elif(board[self.row + 2][self.col - 1].getColor()!= self.color):
-                legalMoves.append((self.row + 2, self.col - 1, 'hit'))
-        if(self.row < 6 and self.col < 7):
-            if(board[self.row + 2][self.col + 1] == None):
-                legalMoves.append((self.row + 2, self.col + 1))
-            elif(board[self.row + 2][self.col + 1].getColor()!= self.color):
-                legalMoves.append((self.row + 2, self.col + 1, 'hit'))
-        if(self.row > 0 and self.col > 1):
-            if(board[self.row - 1][self.col - 2] == None):
-                legalMoves.append((self.row - 1, self.col - 2))
-            elif(board[self.row - 1][self.col - 2].getColor()!= self.color):
-                legalMoves.append((self.row - 1, self.col - 2, 'hit'))
-        if(self.row < 7 and self.col > 1):
-            if(board[self.row + 1][self.col - 2] == None):
-                legalMoves.append((self.row + 1, self.col - 2))
-            elif(board[self.row + 1][self.col - 2].getColor()!= self.color):
-                legalMoves.append((self.row + 1, self.col - 2, 'hit'))
-        if(self.row > 0 and self.col < 6):
-            if(board[self.row - 1][self.col + 2] == None):
-                legalMoves.append((self.row - 1, self.col + 2))
-            elif(board[self.row - 1][self.col + 2].getColor()!= self.color):
-                legalMoves.append((self.row - 1, self.col + 2, 'hit'))
-        if(self.row < 7 and self.col < 6):
-            if(board[self.row + 1][self.col + 2] == None):
-                legalMoves.append((self.row + 1, self.col + 2))
-            elif(board[self.row + 1][self.col + 2].getColor()!= self.color):
-                legalMoves.append((self.row + 1, self.col + 2, 'hit'))
-        return legalMoves
 
 class king(piece):
+    __slots__ = ('hasMoved', 'kingside', 'queenside', 'image')
     def __init__(self, color, row, col):
         self.color = color
         self.row = row
@@ -817,159 +521,17 @@ class king(piece):
         return self.hasMoved
     def changepermission(self, newperm):
         self.hasMoved = newperm
-    def moves(self, board):
-        legalMoves = []
-        for i in [-1, 0, 1]:
-            for j in [-1, 0, 1]:
-                if(i == 0 and j == 0):
-                    continue
-                if((self.col+j <= 7) and (self.col+j >= 0) 
-                and (self.row+i <= 7) and (self.row+i >= 0)):
-                    if(board[self.row+i][self.col+j] == None):
-                        legalMoves.append((self.row+i, self.col+j))
-                    elif(board[self.row+i][self.col+j].getColor()!= self.color):
-                        legalMoves.append((self.row+i, self.col+j, 'hit'))
-        #kingside castle for white
-        if((not self.hasMoved) and (self.kingside) and 
-            (board[self.row][self.col+1]==None) and 
-            (board[self.row][self.col+2]==None) and (self.color == 'white')):
-            legalMoves.append((self.row, self.col+2, 'wkcastled'))
-        #queenside castle for white
-        if((not self.hasMoved) and (self.queenside) and 
-            (board[self.row][self.col-1]==None) and 
-            (board[self.row][self.col-2]==None) and
-            (board[self.row][self.col-3]==None) and (self.color == 'white')):
-            legalMoves.append((self.row, self.col-2, 'wqcastled'))
-        if((not self.hasMoved) and (self.kingside) and 
-            (board[self.row][self.col+1]==None) and 
-            (board[self.row][self.col+2]==None) and (self.color == 'black')):
-            legalMoves.append((self.row, self.col+2, 'bkcastled'))
-        if((not self.hasMoved) and (self.queenside) and 
-            (board[self.row][self.col-1]==None) and 
-            (board[self.row][self.col-2]==None) and
-            (board[self.row][self.col-3]==None) and (self.color == 'black')):
-            legalMoves.append((self.row, self.col-2, 'bqcastled'))
-        return legalMoves
 
 class queen(piece):
+    __slots__ = ('image',)
     def __init__(self, color, row, col):
         self.color = color
         self.row = row
         self.col = col
         self.image = f'{self.color}queen.png'
-    def moves(self, board):
-        legalMoves = []
-        #checking upleft
-        if(self.row != 0 and self.col != 0):
-            upleft = 1
-            edgeCase = False
-            while(board[self.row-upleft][self.col-upleft] == None):
-                    legalMoves.append((self.row-upleft, self.col-upleft))
-                    upleft += 1
-                    if(self.col-upleft < 0 or self.row-upleft < 0):
-                        edgeCase = True
-                        break
-            if(not edgeCase and 
-            board[self.row-upleft][self.col-upleft].getColor()!=self.color):
-                legalMoves.append((self.row-upleft, self.col-upleft, 'hit'))
-        #checking upright
-        if(self.row != 0 and self.col != 7):
-            upright = 1
-            edgeCase = False
-            while(board[self.row-upright][self.col+upright] == None):
-                    legalMoves.append((self.row-upright, self.col+upright))
-                    upright += 1
-                    if(self.col+upright > 7 or self.row-upright < 0):
-                        edgeCase = True
-                        break
-            if(not edgeCase and 
-            board[self.row-upright][self.col+upright].getColor()!=
-            self.color):
-                legalMoves.append((self.row-upright, self.col+upright, 'hit'))
-        #checking downleft
-        if(self.row != 7 and self.col != 0):
-            downleft = 1
-            edgeCase = False
-            while(board[self.row+downleft][self.col-downleft] == None):
-                    legalMoves.append((self.row+downleft, self.col-downleft))
-                    downleft += 1
-                    if(self.col-downleft < 0 or self.row+downleft > 7):
-                        edgeCase = True
-                        break
-            if(not edgeCase and 
-            board[self.row+downleft][self.col-downleft].getColor()!=
-            self.color):
-                legalMoves.append((self.row+downleft, self.col-downleft, 'hit'))
-        #checking downright
-        if(self.row != 7 and self.col != 7):
-            downright = 1
-            edgeCase = False
-            while(board[self.row+downright][self.col+downright] == None):
-                    legalMoves.append((self.row+downright, self.col+downright))
-                    downright += 1
-                    if(self.col+downright > 7 or self.row+downright > 7):
-                        edgeCase = True
-                        break
-            if(not edgeCase and board[self.row+
-            downright][self.col+downright].getColor()!=self.color):
-                legalMoves.append((self.row+downright, 
-                self.col+downright, 'hit'))
-        #checking the left of the rook if not on left edge
-        if(self.col != 0):
-            left = 1
-            edgeCase = False
-            while(board[self.row][self.col-left] == None):
-                legalMoves.append((self.row, self.col-left))
-                left += 1
-                if(self.col-left < 0):
-                    edgeCase = True
-                    break
-            if(not edgeCase and 
-            board[self.row][self.col-left].getColor()!=self.color):
-                legalMoves.append((self.row, self.col-left, 'hit'))
-        #checking the right
-        if(self.col != 7):
-            right = 1
-            edgeCase = False
-            while(board[self.row][self.col+right] == None):
-                legalMoves.append((self.row, self.col+right))
-                right += 1
-                if(self.col+right > 7):
-                    edgeCase = True
-                    break
-            if(not edgeCase and 
-            board[self.row][self.col+right].getColor()!=self.color):
-                legalMoves.append((self.row, self.col+right, 'hit'))
-        #checking upwards
-        if(self.row != 0):
-            up = 1
-            edgeCase = False
-            while(board[self.row-up][self.col] == None):
-                legalMoves.append((self.row-up, self.col))
-                up += 1
-                if(self.row-up < 0):
-                    edgeCase = True
-                    break
-            if(not edgeCase and 
-            board[self.row-up][self.col].getColor()!=self.color):
-                legalMoves.append((self.row-up, self.col, 'hit'))
-        #checking downwards
-        if(self.row != 7):
-            down = 1
-            edgeCase = False
-            while(board[self.row+down][self.col] == None):
-                legalMoves.append((self.row+down, self.col))
-                down += 1
-                if(self.row+down > 7):
-                    edgeCase = True
-                    break
-            if(not edgeCase and 
-            board[self.row+down][self.col].getColor()!=self.color):
-                legalMoves.append((self.row+down, self.col, 'hit'))
-
-        return legalMoves
 
 class rook(piece):
+    __slots__ = ('castle', 'hasMoved', 'image')
     def __init__(self, color, row, col):
         self.color = color
         self.row = row
@@ -977,61 +539,57 @@ class rook(piece):
         self.castle = True
         self.hasMoved = False
         self.image = f'{self.color}rook.png'
-    def moves(self, board):
-        legalMoves = []
-        #checking the left of the rook if not on left edge
-        if(self.col != 0):
-            left = 1
-            edgeCase = False
-            while(board[self.row][self.col-left] == None):
-                legalMoves.append((self.row, self.col-left))
-                left += 1
-                if(self.col-left < 0):
-                    edgeCase = True
-                    break
-            if(not edgeCase and 
-            board[self.row][self.col-left].getColor()!=self.color):
-                legalMoves.append((self.row, self.col-left, 'hit'))
-        #checking the right
-        if(self.col != 7):
-            right = 1
-            edgeCase = False
-            while(board[self.row][self.col+right] == None):
-                legalMoves.append((self.row, self.col+right))
-                right += 1
-                if(self.col+right > 7):
-                    edgeCase = True
-                    break
-            if(not edgeCase and 
-            board[self.row][self.col+right].getColor()!=self.color):
-                legalMoves.append((self.row, self.col+right, 'hit'))
-        #checking upwards
-        if(self.row != 0):
-            up = 1
-            edgeCase = False
-            while(board[self.row-up][self.col] == None):
-                legalMoves.append((self.row-up, self.col))
-                up += 1
-                if(self.row-up < 0):
-                    edgeCase = True
-                    break
-            if(not edgeCase and 
-            board[self.row-up][self.col].getColor()!=self.color):
-                legalMoves.append((self.row-up, self.col, 'hit'))
-        #checking downwards
-        if(self.row != 7):
-            down = 1
-            edgeCase = False
-            while(board[self.row+down][self.col] == None):
-                legalMoves.append((self.row+down, self.col))
-                down += 1
-                if(self.row+down > 7):
-                    edgeCase = True
-                    break
-            if(not edgeCase and 
-            board[self.row+down][self.col].getColor()!=self.color):
-                legalMoves.append((self.row+down, self.col, 'hit'))
-        return legalMoves
+
+#engine piece type for each piece class
+PIECE_TYPES = {pawn: engine.PAWN, knight: engine.KNIGHT, bishop: engine.BISHOP,
+               rook: engine.ROOK, queen: engine.QUEEN, king: engine.KING}
+#and the piece class for each engine piece type
+PIECE_CLASSES = {ptype: pieceClass for pieceClass, ptype in PIECE_TYPES.items()}
+
+#builds the bitboard position the engine works on from the pieces on the board
+def buildPosition(plist):
+    position = engine.Position()
+    for row in range(8):
+        for col in range(8):
+            piece = plist[row][col]
+            if(piece != None):
+                position.addPiece(engine.colorIndex(piece.color),
+                                  PIECE_TYPES[type(piece)], engine.square(row, col))
+    return position
+
+#re-derives the engine position from the board, used when a game (re)starts
+def syncPosition(app):
+    position = buildPosition(app.plist)
+    position.sideToMove = engine.WHITE if app.turn else engine.BLACK
+    castling = 0
+    if(not app.whiteking.hasMoved):
+        if(app.whiteking.kingside):
+            castling |= engine.CASTLE_WK
+        if(app.whiteking.queenside):
+            castling |= engine.CASTLE_WQ
+    if(not app.blackking.hasMoved):
+        if(app.blackking.kingside):
+            castling |= engine.CASTLE_BK
+        if(app.blackking.queenside):
+            castling |= engine.CASTLE_BQ
+    position.castling = castling
+    #the square behind a pawn that just moved two squares
+    if(app.storePreviousType == pawn and abs(app.storeOriginal-app.storePrevious[0]) == 2):
+        position.epSquare = engine.square((app.storeOriginal+app.storePrevious[0])//2,
+                                          app.storePrevious[1])
+    position.key = engine.zobristKey(position)
+    app.position = position
+
+#finds the engine move for a UI move of the piece on (row, col); promotions
+#are matched against the piece type the pawn was promoted to
+def packMove(app, row, col, move, promoteTo=engine.QUEEN):
+    fromSq = engine.square(row, col)
+    for packed in app.position.legalMoves():
+        if(packed & 63 == fromSq and engine.toUIMove(packed) == tuple(move)):
+            flag = packed >> 12
+            if(not flag & engine.PROMOTION or flag & 3 == promoteTo - engine.KNIGHT):
+                return packed
+    return None
 
 #checks if position is in bounds
 def inBound(row, col):
@@ -1041,210 +599,8 @@ def inBound(row, col):
 
 #checks if position is in check for the color king that is given
 def inCheck(app, row, col, color):
-    n=1
-    #upleft
-    while(row-n>0 and col-n>0 and app.plist[row-n][col-n]==None):
-        n+=1
-    if(inBound(row-n, col-n)):
-        check = app.plist[row-n][col-n]
-        if(check != None and ((type(check)==bishop or type(check)==queen) and check.color!=color)):
-            return True
-        if(n==1):
-            if(check != None and type(check)==king and check.color!=color):
-                return True
-            elif(check != None and type(check)==pawn and check.color!=color and check.color=='black'):
-                return True
-    #upright
-    n=1
-    while(row-n>0 and col+n<7 and app.plist[row-n][col+n]==None):
-        n+=1
-    if(inBound(row-n, col+n)):
-        check = app.plist[row-n][col+n]
-        if(check != None and ((type(check)==bishop or type(check)==queen) and check.color!=color)):
-            return True
-        if(n==1):
-            if(check != None and type(check)==king and check.color!=color):
-                return True
-            elif(check != None and type(check)==pawn and check.color!=color and check.color=='black'):
-                return True
-    #downleft
-    n=1
-    while(row+n<7 and col-n>0 and app.plist[row+n][col-n]==None):
-        n+=1
-    if(inBound(row+n, col-n)):
-        check = app.plist[row+n][col-n]
-        if(check != None and ((type(check)==bishop or type(check)==queen) and check.color!=color)):
-            return True
-        if(n==1):
-            if(check != None and type(check)==king and check.color!=color):
-                return True
-            elif(check != None and type(check)==pawn and check.color!=color and check.color=='white'):
-                return True
-    #downright
-    n=1
-    while(row+n<7 and col+n<7 and app.plist[row+n][col+n]==None):
-        n+=1
-    if(inBound(row+n, col+n)):
-        check = app.plist[row+n][col+n]
-        if(check != None and (type(check)==bishop or type(check)==queen) and check.color!=color):
-            return True
-        if(n==1):
-            if(check != None and type(check)==king and check.color!=color):
-                return True
-            elif(check != None and type(check)==pawn and check.color!=color and check.color=='white'):
-                return True
-    #up
-    n=1
-    while(row-n>0 and app.plist[row-n][col]==None):
-        n+=1
-    if(inBound(row-n, col)):
-        check = app.plist[row-n][col]
-        if(check != None and (type(check)==rook or type(check)==queen) and check.color!=color):
-            return True
-        if(check != None and n==1 and type(check)==king and check.color!=color):
-            return True
-    #down
-    n=1
-    while(row+n<7 and app.plist[row+n][col]==None):
-        n+=1
-    if(inBound(row+n, col)):
-        check = app.plist[row+n][col]
-        if(check != None and (type(check)==rook or type(check)==queen) and check.color!=color):
-            return True
-        if(check != None and n==1 and type(check)==king and check.color!=color):
-            return True
-    #left
-    n=1
-    while(col-n>0 and app.plist[row][col-n]==None):
-        n+=1
-    if(inBound(row, col-n)):
-        check = app.plist[row][col-n]
-        if(check != None and ((type(check)==rook or type(check)==queen) and check.color!=color)):
-            return True
-        if(check != None and n==1 and type(check)==king and check.color!=color):
-            return True
-    #right
-    n=1
-    while(col+n<7 and app.plist[row][col+n]==None):
-        n+=1
-    if(inBound(row, col+n)):
-        check = app.plist[row][col+n]
-        if(check != None and ((type(check)==rook or type(check)==queen) and check.color!=color)):
-            return True
-        if(check != None and n==1 and type(check)==king and check.color!=color):
-            return True
-    #knight upleft
-    if(row > 1 and col > 0):
-        check = app.plist[row-2][col-1]
-        if(check != None and check.color!=color and type(check) == knight):
-            return True
-    #knight upright
-    if(row > 1 and col < 7):
-        check = app.plist[row-2][col+1]
-        if(check != None and check.color!=color and type(check) == knight):
-            return True
-    #knight downleft
-    if(row < 6 and col > 0):
-        check = app.plist[row+2][col-1]
-        if(check != None and check.color!=color and type(check) == knight):
-            return True
-    #knight downright
-    if(row < 6 and col < 7):
-        check = app.plist[row+2][col+1]
-        if(check != None and check.color!=color and type(check) == knight):
-            return True
-    #knight leftup
-    if(row > 0 and col > 1):
-        check = app.plist[row-1][col-2]
-        if(check != None and check.color!=color and type(check) == knight):
-            return True
-    #knight leftdown
-    if(row < 7 and col > 1):
-        check = app.plist[row+1][col-2]
-        if(check != None and check.color!=color and type(check) == knight):
-            return True
-    #knight rightup
-    if(row > 0 and col < 6):
-        check = app.plist[row-1][col+2]
-        if(check != None and check.color!=color and type(check) == knight):
-            return True
-    #knight rightdown
-    if(row < 7 and col < 6):
-        check = app.plist[row+1][col+2]
-        if(check != None and check.color!=color and type(check) == knight):
-            return True
-    return False
-
-#given a list of moves, filters out moves that leave king in check/illegal
-def actualMoves(app, possiblemoves):
-    import time
-    startTime = time.time()
-    actualmoves = []
-    inCheckCount = 0
-    for move in possiblemoves:
-        #checks if castle is allowed
-        if(len(move)>2 and move[2]=='wkcastled'):
-            if(inCheck(app, app.whiteking.row, app.whiteking.col, 'white') or 
-            inCheck(app, app.whiteking.row, app.whiteking.col+1, 'white') or
-            inCheck(app, app.whiteking.row, app.whiteking.col+2, 'white')):
-                continue
-        elif(len(move)>2 and move[2]=='bkcastled'):
-            if(inCheck(app, app.blackking.row, app.blackking.col, 'black') or
-            inCheck(app, app.blackking.row, app.blackking.col+2, 'black') or
-            inCheck(app, app.blackking.row, app.blackking.col+1, 'black')):
-                continue
-        elif(len(move)>2 and move[2]=='wqcastled'):
-            if(inCheck(app, app.whiteking.row, app.whiteking.col, 'white') or 
-            inCheck(app, app.whiteking.row, app.whiteking.col-1, 'white') or
-            inCheck(app, app.whiteking.row, app.whiteking.col-2, 'white') or 
-            inCheck(app, app.whiteking.row, app.whiteking.col-3, 'white')):
-                continue
-        elif(len(move)>2 and move[2]=='bqcastled'):
-            if(inCheck(app, app.blackking.row, app.blackking.col, 'black') or 
-            inCheck(app, app.blackking.row, app.blackking.col-1, 'black') or
-            inCheck(app, app.blackking.row, app.blackking.col-2, 'black') or 
-            inCheck(app, app.blackking.row, app.blackking.col-3, 'black')):
-                continue
-        #checks if enpassant is possible for white left
-        if(len(move)>2 and move[2]=='wlenpassant'):
-            if(app.storePreviousType != pawn or app.storePrevious[0]-1 != move[0] 
-            or app.storePrevious[1]!=move[1] or abs(app.storeOriginal-app.storePrevious[0])!=2):
-                continue
-        #white right enpassant
-        if(len(move)>2 and move[2]=='wrenpassant'):
-            if(app.storePreviousType != pawn or (app.storePrevious[0]-1) != move[0] 
-            or app.storePrevious[1]!=move[1] or abs(app.storeOriginal-app.storePrevious[0])!=2):
-                continue
-        #black left enpassant
-        if(len(move)>2 and move[2]=='blenpassant'):
-            if(app.storePreviousType != pawn or app.storePrevious[0]+1 != move[0] 
-            or app.storePrevious[1]!=move[1] or abs(app.storeOriginal-app.storePrevious[0])!=2):
-                continue
-        #black right enpassant
-        if(len(move)>2 and move[2]=='brenpassant'):
-            if(app.storePreviousType != pawn or app.storePrevious[0]+1 != move[0] 
-            or app.storePrevious[1]!=move[1] or abs(app.storeOriginal-app.storePrevious[0])!=2):
-                continue
-
-        #backtracks: makes the move, checks if own king is in check after, removes if illegal
-        saveState = app.plist[app.prevclick[0]][app.prevclick[1]]
-        saveState2 = app.plist[move[0]][move[1]]
-        app.plist[move[0]][move[1]] = app.plist[app.prevclick[0]][app.prevclick[1]]
-        app.plist[app.prevclick[0]][app.prevclick[1]] = None
-        app.plist[move[0]][move[1]].row = move[0]
-        app.plist[move[0]][move[1]].col = move[1]
-        if(saveState.color == 'white'):
-            if(not inCheck(app, app.whiteking.row, app.whiteking.col, 'white')):
-                actualmoves.append(move)
-        elif(saveState.color == 'black'):
-            if(not inCheck(app, app.blackking.row, app.blackking.col, 'black')):
-                actualmoves.append(move)
-        app.plist[app.prevclick[0]][app.prevclick[1]] = saveState
-        app.plist[app.prevclick[0]][app.prevclick[1]].row = app.prevclick[0]
-        app.plist[app.prevclick[0]][app.prevclick[1]].col = app.prevclick[1]
-        app.plist[move[0]][move[1]] = saveState2
-    
-    return actualmoves
+    attacked = app.position.attacks(engine.colorIndex(color) ^ 1)
+    return attacked >> engine.square(row, col) & 1 == 1
 
 #restarts the game if prompted
 def restartGame(app):
@@ -1292,22 +648,23 @@ def restartGame(app):
     app.storeOriginal = None
     app.storePrevious = None
     app.storePreviousType = None
-    app.whitetakenpieces = []
-    app.blacktakenpieces = []
-    app.whitepieces = [app.whiterook1, app.whiterook2, app.whiteknight1, 
+    app.whitetakenpieces = PieceList()
+    app.blacktakenpieces = PieceList()
+    app.whitepieces = PieceList([app.whiterook1, app.whiterook2, app.whiteknight1, 
         app.whiteknight2, app.whitebishop1, app.whitebishop2, app.whitequeen,
         app.whitepawn1, app.whitepawn2, app.whitepawn3, app.whitepawn4, 
-        app.whitepawn5, app.whitepawn6, app.whitepawn7, app.whitepawn8, app.whiteking]
-    app.blackpieces = [app.blackrook1, app.blackrook2, app.blackknight1, 
+        app.whitepawn5, app.whitepawn6, app.whitepawn7, app.whitepawn8, app.whiteking])
+    app.blackpieces = PieceList([app.blackrook1, app.blackrook2, app.blackknight1, 
         app.blackknight2, app.blackbishop1, app.blackbishop2, app.blackqueen,
         app.blackpawn1, app.blackpawn2, app.blackpawn3, app.blackpawn4, 
-        app.blackpawn5, app.blackpawn6, app.blackpawn7, app.blackpawn8, app.blackking]
+        app.blackpawn5, app.blackpawn6, app.blackpawn7, app.blackpawn8, app.blackking])
     app.prevclick = None
     app.firstclickwork = False
     app.numTurns = 0
     app.gameOver = False
     app.winner = ""
     app.computerThinking = False
+    app.searchInfo = None
     
     # Reset animation state
     app.animatingPiece = None
@@ -1340,6 +697,8 @@ def restartGame(app):
         board.append(addrow)
     app.board = board
     app.undoList = []
+    search.ponderer.stop()
+    syncPosition(app)
 
 def undoMove(app):
     #0: original piece row
@@ -1353,6 +712,7 @@ def undoMove(app):
     #8: color
     #9: special instance
     #10: special instance 2 for castling
+    search.ponderer.stop()
     u = app.undoList[-1]
     #removes the first click to stop turn from glitching
     app.prevclick = None
@@ -1363,15 +723,13 @@ def undoMove(app):
     #only run through this if promoted, need to remove promoted piece from pieces
     #also need to add the deleted pawn back
     if(len(u)>9 and u[9] == 'promotion' and u[8]=='white'):
-        app.whitepieces.remove(app.plist[u[7][0]][u[7][1]])
+        app.whitepieces.replace(app.plist[u[7][0]][u[7][1]], u[10])
         app.plist[u[7][0]][u[7][1]] = u[3]
         app.plist[u[0]][u[1]] = u[10]
-        app.whitepieces.append(app.plist[u[0]][u[1]])
     elif(len(u)>9 and u[9] == 'promotion' and u[8]=='black'):
-        app.blackpieces.remove(app.plist[u[7][0]][u[7][1]])
+        app.blackpieces.replace(app.plist[u[7][0]][u[7][1]], u[10])
         app.plist[u[7][0]][u[7][1]] = u[3]
         app.plist[u[0]][u[1]] = u[10]
-        app.blackpieces.append(app.plist[u[0]][u[1]])
     else:
         app.plist[u[7][0]][u[7][1]] = u[3]
     #if the piece is not nothing 
@@ -1448,6 +806,7 @@ def undoMove(app):
         app.numTurns -=1
     #switches the turn counter
     app.turn = not app.turn
+    app.position.unmake()
 
 def onKeyPress(app, key):
     if(key == 'p'):
@@ -1488,15 +847,21 @@ def makeComputerMove(app):
         app.computerThinking = False
         return
     
-    piece, move = computerMove
+    piece, move, promoteTo = computerMove
     
     # Execute the move (similar to the human move logic in mousePressed)
-    executeMove(app, piece, move)
+    executeMove(app, piece, move, promoteTo)
     
     app.computerThinking = False
-
-def executeMove(app, piece, move):
-    """Execute a move (used by both human and AI)."""
+    # Easy answers at once anyway, so only medium and hard think ahead
+    if app.pondering and app.difficulty != 'easy' and not app.gameOver:
+        # Search the human's likely reply while they think
+        search.ponderer.start(app.position.copy(), app.difficulty)
+
+def executeMove(app, piece, move, promoteTo=engine.QUEEN):
+    """Execute a move (used by both human and AI). A pawn reaching the last
+    rank becomes the piece type promoteTo."""
+    fromRow, fromCol = piece.row, piece.col
     # Store for undo functionality
     if app.turn:
         app.undoList.append([
@@ -1541,13 +906,13 @@ def executeMove(app, piece, move):
     app.plist[originalRow][originalCol] = None
     app.plist[move[0]][move[1]] = piece
     
-    # Handle pawn promotion (simplified for AI)
+    # Handle pawn promotion, to the piece the AI picked
     if type(piece) == pawn and piece.needPromotion():
-        # Auto-promote to queen for AI
-        newPiece = queen(piece.color, piece.row, piece.col)
+        newPiece = PIECE_CLASSES[promoteTo](piece.color, piece.row, piece.col)
         promotion(app, piece, newPiece, piece.color)
         app.plist[move[0]][move[1]] = newPiece
         app.undoList[-1].extend(["promotion", piece])
+    app.position.make(packMove(app, fromRow, fromCol, move, promoteTo))
     
     # Change turn
     if not app.turn:
@@ -1573,7 +938,25 @@ def handleSpecialMoves(app, piece, move):
             else:
                 app.blacktakenpieces.append(capturedPiece)
                 app.whitepieces.remove(capturedPiece)
-        # Handle other special moves (castling, en passant) - simplified for now
+        elif move[2].endswith('castled'):
+            # The rook jumps to the other side of the king
+            fromCol, toCol = (7, 5) if move[2][1] == 'k' else (0, 3)
+            castledRook = app.plist[move[0]][fromCol]
+            app.plist[move[0]][toCol] = castledRook
+            castledRook.col = toCol
+            app.plist[move[0]][fromCol] = None
+        elif move[2].endswith('enpassant'):
+            # The captured pawn sits behind the destination square
+            row = move[0] + 1 if piece.color == 'white' else move[0] - 1
+            capturedPiece = app.plist[row][move[1]]
+            if piece.color == 'white':
+                app.whitetakenpieces.append(capturedPiece)
+                app.blackpieces.remove(capturedPiece)
+            else:
+                app.blacktakenpieces.append(capturedPiece)
+                app.whitepieces.remove(capturedPiece)
+            app.undoList[-1].append(capturedPiece)
+            app.plist[row][move[1]] = None
     
     # Update king/rook movement flags for castling
     updateCastlingRights(app, piece)
@@ -1596,28 +979,26 @@ def updateCastlingRights(app, piece):
             app.blackking.queenside = False
 
 def checkGameOver(app):
-    """Check for checkmate or stalemate."""
+    """Check for checkmate, stalemate or threefold repetition."""
     color = 'white' if app.turn else 'black'
     king = app.whiteking if app.turn else app.blackking
-    pieces = app.whitepieces if app.turn else app.blackpieces
     
     # Count valid moves
-    totalMoves = 0
-    for piece in pieces:
-        possibleMoves = piece.moves(app.plist)
-        originalPrevclick = app.prevclick
-        app.prevclick = [piece.row, piece.col]
-        validMoves = actualMoves(app, possibleMoves)
-        app.prevclick = originalPrevclick
-        totalMoves += len(validMoves)
+    totalMoves = len(engine.legalMoves(app.position, engine.colorIndex(color)))
     
     if totalMoves == 0:
+        search.ponderer.stop()
         if inCheck(app, king.row, king.col, color):
             app.gameOver = True
             app.winner = 'Black' if app.turn else 'White'
         else:
             app.gameOver = True
             app.winner = ""  # Stalemate
+    elif app.position.repetitions() >= 2:
+        #the same position for the third time, counted by its Zobrist key
+        search.ponderer.stop()
+        app.gameOver = True
+        app.winner = ""
 
 def onMousePress(app, mouseX, mouseY):
     #as long as game is not over and game hasn't started (menu screen)
@@ -1709,10 +1090,8 @@ def onMousePress(app, mouseX, mouseY):
                 app.firstclickwork = True
         #first click
         elif(app.firstclickwork):
-            #iterates through every move
-            possiblemoves = app.plist[app.prevclick[0]][app.prevclick[1]].moves(app.plist)
-            #remove the illegal moves through checking in actualMoves
-            actualmoves = actualMoves(app, possiblemoves)
+            #iterates through every legal move
+            actualmoves = app.plist[app.prevclick[0]][app.prevclick[1]].moves(app.position)
             for move in actualmoves:
                 if(move[0] == dy and move[1] == dx):
                     if(app.turn):
@@ -1866,6 +1245,8 @@ def onMousePress(app, mouseX, mouseY):
                                 app.plist[move[0]][move[1]] = newPiece
                             #adding to special move 
                             app.undoList[-1].extend(["promotion", promotionSquare])
+                    app.position.make(packMove(app, app.prevclick[0], app.prevclick[1], move,
+                                               PIECE_TYPES[type(app.plist[move[0]][move[1]])]))
                     #after black's turn, change the total move counter
                     if(not app.turn):
                         app.numTurns+=1
@@ -1875,83 +1256,15 @@ def onMousePress(app, mouseX, mouseY):
             #resets the click
             app.prevclick = None
             app.firstclickwork = False
-        #checks for white checkmate
-        if(app.turn):
-            total = 0
-            for piece in app.whitepieces:
-                possiblemoves = piece.moves(app.plist)
-                actualmoves = []
-                #for all the possible moves, if it works, add to actual moves. 
-                for move in possiblemoves:
-                    saveState = piece
-                    piecerow = piece.row
-                    piececol = piece.col
-                    saveState2 = app.plist[move[0]][move[1]]
-                    app.plist[move[0]][move[1]] = piece
-                    app.plist[move[0]][move[1]].row = move[0]
-                    app.plist[move[0]][move[1]].col = move[1]
-                    app.plist[piecerow][piececol] = None
-                    if(saveState.color == 'white'):
-                        if(not inCheck(app, app.whiteking.row, app.whiteking.col, 'white')):
-                            actualmoves.append(move)
-                    else:
-                        if(not inCheck(app, app.blackking.row, app.blackking.col, 'black')):
-                            actualmoves.append(move)
-                    app.plist[piecerow][piececol] = saveState
-                    app.plist[piecerow][piececol].row = piecerow
-                    app.plist[piecerow][piececol].col = piececol
-                    app.plist[move[0]][move[1]] = saveState2
-                total+=len(actualmoves)
-            #total moves is 0 when checkmate, so gameOver is changed
-            if(total == 0):
-                if(not inCheck(app, app.whiteking.row, app.whiteking.col, 'white')):
-                    app.gameOver = True
-                    app.winner = ""
-                else:
-                    app.gameOver = True
-                    app.winner = 'Black'
-        #checks for black checkmate, same format
-        else:
-            total = 0
-            for piece in app.blackpieces:
-                possiblemoves = piece.moves(app.plist)
-                actualmoves = []
-                for move in possiblemoves:
-                    saveState = piece
-                    piecerow = piece.row
-                    piececol = piece.col
-                    saveState2 = app.plist[move[0]][move[1]]
-                    app.plist[move[0]][move[1]] = piece
-                    app.plist[move[0]][move[1]].row = move[0]
-                    app.plist[move[0]][move[1]].col = move[1]
-                    app.plist[piecerow][piececol] = None
-                    if(saveState.color == 'white'):
-                        if(not inCheck(app, app.whiteking.row, app.whiteking.col, 'white')):
-                            actualmoves.append(move)
-                    else:
-                        if(not inCheck(app, app.blackking.row, app.blackking.col, 'black')):
-                            actualmoves.append(move)
-                    app.plist[piecerow][piececol] = saveState
-                    app.plist[piecerow][piececol].row = piecerow
-                    app.plist[piecerow][piececol].col = piececol
-                    app.plist[move[0]][move[1]] = saveState2
-                total+=len(actualmoves)
-            if(total == 0):
-                if(not inCheck(app, app.blackking.row, app.blackking.col, 'black')):
-                    app.gameOver = True
-                    app.winner = ""
-                else:
-                    app.gameOver = True
-                    app.winner = 'White'
+        #checks for checkmate or stalemate for the side to move
+        checkGameOver(app)
 
-#promotion adds the new piece to pieces list while removing the pawn
+#promotion puts the new piece in the pawn's place in the pieces list
 def promotion(app, promotedPawn, newPiece, color):
     if(color == 'white'):
-        app.whitepieces.remove(promotedPawn)
-        app.whitepieces.append(newPiece)
+        app.whitepieces.replace(promotedPawn, newPiece)
     else:
-        app.blackpieces.remove(promotedPawn)
-        app.blackpieces.append(newPiece)
+        app.blackpieces.replace(promotedPawn, newPiece)
 
 
 def redrawAll(app):
@@ -2038,6 +1351,11 @@ def redrawAll(app):
                 turnText += ' (AI)'
             drawLabel(turnText, app.width/2 + 300, 35, 
                      font='Arial', size=20, bold=True)
+        # What the computer's last move cost, for tuning
+        if app.gameMode == 'computer' and app.searchInfo:
+            for i, line in enumerate(app.searchInfo):
+                drawLabel(line, app.width - 20, 52 + 14*i,
+                         font='Arial', size=11, align='right')
         drawLabel(f'Moves: {app.numTurns}', app.width/2 - 300, 35,
                  font='Arial', size=20, bold=True)
         drawBoard(app)
@@ -2048,8 +1366,7 @@ def redrawAll(app):
         #if the first click is on a piece, show the moves for that piece
         if(app.firstclickwork):
             if(app.plist[app.prevclick[0]][app.prevclick[1]] != None):
-                moves = app.plist[app.prevclick[0]][app.prevclick[1]].moves(app.plist)
-                actualmoves = actualMoves(app, moves)
+                actualmoves = app.plist[app.prevclick[0]][app.prevclick[1]].moves(app.position)
                 for move in actualmoves:
                     #checks for 'hit', if hit then make red
                     if(len(move) < 3 or (len(move) > 2 and move[2] == 2)):
@@ -2079,6 +1396,11 @@ def drawGameOver(app):
                  font='Arial', size=20, bold=True)
         drawImage(app.bvictory, app.width/2, app.height/2 + 50, 
                  width=200, height=150, align='center')
+    elif(app.position.repetitions() >= 2):
+        drawLabel('DRAW BY REPETITION', app.width/2, app.height/2,
+                 font='Arial', size=24, bold=True)
+        drawImage(app.stalemate, app.width/2, app.height/2 + 50, 
+                 width=200, height=150, align='center')
     else:
         drawLabel('STALEMATE', app.width/2, app.height/2,
                  font='Arial', size=24, bold=True)
@@ -2413,11 +1735,7 @@ def main():
             currentPlayer = 'white' if app.turn else 'black'
             if currentPlayer == app.computerPlayer:
                 app.computerThinking = True
-                computerMove = getComputerMove(app)
-                if computerMove:
-                    piece, move = computerMove
-                    executeMove(app, piece, move)
-                app.computerThinking = False
+                makeComputerMove(app)
         
         # Redraw everything
         app.screen.fill(COLORS.get('white', (255, 255, 255)))
@@ -0,0 +1,751 @@
+#Bitboard position used by the chess engine. Nothing in here imports pygame, so
+#the engine can be used without opening a window.
+#
+#Squares are numbered row*8+col with row 0 being black's back rank, the same
+#layout as app.plist, so square 0 is a8 and square 63 is h1.
+
+from array import array
+import random
+
+WHITE, BLACK = 0, 1
+COLOR_NAMES = ('white', 'black')
+
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+PIECE_VALUES = (1, 3, 3, 5, 9, 0)
+
+#mailbox entry for an empty square, otherwise color*6 + piece type
+EMPTY = -1
+
+FULL = (1 << 64) - 1
+
+#castling rights bits
+CASTLE_WK, CASTLE_WQ, CASTLE_BK, CASTLE_BQ = 1, 2, 4, 8
+
+#moves are packed into 16 bits: from square | to square << 6 | flag << 12
+QUIET, DOUBLE_PUSH, KING_CASTLE, QUEEN_CASTLE = 0, 1, 2, 3
+CAPTURE, EP_CAPTURE = 4, 5
+#promotion flags are 8 + (piece type - KNIGHT), with CAPTURE added for captures
+PROMOTION = 8
+#a8 to a8 never happens, so 0 marks a passed turn in the history
+NULL_MOVE = 0
+
+#castling rights that survive a move touching each square
+CASTLE_KEEP = [CASTLE_WK | CASTLE_WQ | CASTLE_BK | CASTLE_BQ]*64
+CASTLE_KEEP[60] ^= CASTLE_WK | CASTLE_WQ
+CASTLE_KEEP[63] ^= CASTLE_WK
+CASTLE_KEEP[56] ^= CASTLE_WQ
+CASTLE_KEEP[4] ^= CASTLE_BK | CASTLE_BQ
+CASTLE_KEEP[7] ^= CASTLE_BK
+CASTLE_KEEP[0] ^= CASTLE_BQ
+
+#Zobrist keys: one random number per (piece, square), castling rights
+#combination, en passant file and side to move. A fixed seed keeps keys the
+#same in every process and every run.
+_zobristRandom = random.Random(0x5EED)
+ZOBRIST_PIECES = [[_zobristRandom.getrandbits(64) for sq in range(64)] for code in range(12)]
+ZOBRIST_SIDE = _zobristRandom.getrandbits(64)
+_castlingRandoms = [_zobristRandom.getrandbits(64) for right in range(4)]
+ZOBRIST_CASTLING = [0]*16
+for rights in range(16):
+    for bit in range(4):
+        if rights >> bit & 1:
+            ZOBRIST_CASTLING[rights] ^= _castlingRandoms[bit]
+_fileRandoms = [_zobristRandom.getrandbits(64) for col in range(8)]
+#indexed by epSquare + 1 so that "no square" (-1) hashes to 0
+ZOBRIST_EP = [0] + [_fileRandoms[sq & 7] for sq in range(64)]
+
+try:
+    popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+    def popcount(bb):
+        return bin(bb).count('1')
+
+def square(row, col):
+    return row*8 + col
+
+def colorIndex(color):
+    """Convert 'white'/'black' to WHITE/BLACK."""
+    return WHITE if color == 'white' else BLACK
+
+def encodeMove(fromSq, toSq, flag=QUIET):
+    return fromSq | (toSq << 6) | (flag << 12)
+
+def decodeMove(move):
+    """Split a packed move into (from square, to square, flag)."""
+    return move & 63, (move >> 6) & 63, move >> 12
+
+def toUIMove(move):
+    """Convert a packed move to the (row, col[, tag]) tuple the UI uses.
+    Promotions lose their piece type; the UI asks for it separately."""
+    fromSq, toSq, flag = move & 63, (move >> 6) & 63, move >> 12
+    row, col = divmod(toSq, 8)
+    if flag & CAPTURE:
+        if flag == EP_CAPTURE:
+            side = 'l' if col < fromSq % 8 else 'r'
+            return (row, col, ('w' if row == 2 else 'b') + side + 'enpassant')
+        return (row, col, 'hit')
+    if flag == KING_CASTLE:
+        return (row, col, ('w' if row == 7 else 'b') + 'kcastled')
+    if flag == QUEEN_CASTLE:
+        return (row, col, ('w' if row == 7 else 'b') + 'qcastled')
+    return (row, col)
+
+FILES = 'abcdefgh'
+PROMOTION_LETTERS = 'nbrq'
+
+def squareName(sq):
+    """Algebraic name of a square, e.g. 52 -> 'e2'."""
+    return FILES[sq & 7] + str(8 - (sq >> 3))
+
+def moveName(move):
+    """Coordinate notation for a packed move, e.g. 'e2e4' or 'e7e8q'."""
+    flag = move >> 12
+    name = squareName(move & 63) + squareName((move >> 6) & 63)
+    if flag & PROMOTION:
+        name += PROMOTION_LETTERS[flag & 3]
+    return name
+
+class Position:
+    """Bitboard position: one 64-bit board per color and piece type, plus
+    occupancy boards and a square -> piece mailbox for fast lookups.
+
+    Holds everything needed to play on from here (side to move, castling
+    rights, en passant square, clocks) and never touches the UI, so copies
+    can be searched anywhere."""
+    __slots__ = ('pieces', 'occupied', 'occupiedAll', 'board', 'sideToMove',
+                 'castling', 'epSquare', 'halfmoveClock', 'fullmoveNumber',
+                 'key', 'attackMaps', 'history', 'keyCounts')
+
+    def __init__(self):
+        self.pieces = [[0]*6, [0]*6]
+        self.occupied = [0, 0]
+        self.occupiedAll = 0
+        self.board = [EMPTY]*64
+        self.sideToMove = WHITE
+        self.castling = 0
+        #square a pawn can capture onto en passant, -1 if none
+        self.epSquare = -1
+        #plies since the last capture or pawn move, and the move number
+        self.halfmoveClock = 0
+        self.fullmoveNumber = 1
+        #Zobrist key, kept up to date by every change to the position
+        self.key = 0
+        #squares attacked by each color, built on demand by attacks()
+        self.attackMaps = [None, None]
+        #(move, captured code, castling, epSquare, halfmoveClock, key,
+        #attackMaps) from before each made move
+        self.history = []
+        #key -> how many times it occurs in history (passed turns aside), so
+        #repetitions are found without walking back through the history
+        self.keyCounts = {}
+
+    def copy(self):
+        other = Position.__new__(Position)
+        other.pieces = [self.pieces[0][:], self.pieces[1][:]]
+        other.occupied = self.occupied[:]
+        other.occupiedAll = self.occupiedAll
+        other.board = self.board[:]
+        other.sideToMove = self.sideToMove
+        other.castling = self.castling
+        other.epSquare = self.epSquare
+        other.halfmoveClock = self.halfmoveClock
+        other.fullmoveNumber = self.fullmoveNumber
+        other.key = self.key
+        other.attackMaps = self.attackMaps[:]
+        other.history = self.history[:]
+        other.keyCounts = self.keyCounts.copy()
+        return other
+
+    def __getstate__(self):
+        """Pickle as the mailbox in 64 bytes, the scalar fields and one
+        64-bit word per history entry; bitboards and attack maps are
+        rebuilt on load."""
+        history = array('Q', [move | (captured + 1) << 16 | castling << 20 |
+                              (epSquare + 1) << 24 | halfmoveClock << 32
+                              for move, captured, castling, epSquare, halfmoveClock, _, _
+                              in self.history])
+        return (bytes([code + 1 for code in self.board]), self.sideToMove, self.castling,
+                self.epSquare, self.halfmoveClock, self.fullmoveNumber, history.tobytes())
+
+    def __setstate__(self, state):
+        board, sideToMove, castling, epSquare, halfmoveClock, fullmoveNumber, history = state
+        self.__init__()
+        for sq, code in enumerate(board):
+            if code:
+                self.addPiece((code - 1) // 6, (code - 1) % 6, sq)
+        self.sideToMove = sideToMove
+        self.castling = castling
+        self.epSquare = epSquare
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.key = zobristKey(self)
+        words = array('Q')
+        words.frombytes(history)
+        self.history = [(word & 0xffff, (word >> 16 & 15) - 1, word >> 20 & 15,
+                         (word >> 24 & 127) - 1, word >> 32, 0, [None, None])
+                        for word in words]
+        #the keys of earlier positions come from stepping a scratch copy back
+        #(its counts only need to last out the unmakes)
+        self.keyCounts = {0: len(self.history)}
+        scratch = self.copy()
+        for index in range(len(self.history) - 1, -1, -1):
+            scratch.unmake()
+            entry = self.history[index]
+            self.history[index] = entry[:5] + (zobristKey(scratch), entry[6])
+        self.keyCounts = {}
+        for entry in self.history:
+            if entry[0] != NULL_MOVE:
+                self.keyCounts[entry[5]] = self.keyCounts.get(entry[5], 0) + 1
+
+    def addPiece(self, color, ptype, sq):
+        bit = 1 << sq
+        self.pieces[color][ptype] |= bit
+        self.occupied[color] |= bit
+        self.occupiedAll |= bit
+        self.board[sq] = color*6 + ptype
+        self.key ^= ZOBRIST_PIECES[color*6 + ptype][sq]
+
+    def removePiece(self, sq):
+        """Clear a square and return the mailbox code that was on it."""
+        code = self.board[sq]
+        if code != EMPTY:
+            color, ptype = divmod(code, 6)
+            bit = 1 << sq
+            self.pieces[color][ptype] ^= bit
+            self.occupied[color] ^= bit
+            self.occupiedAll ^= bit
+            self.board[sq] = EMPTY
+            self.key ^= ZOBRIST_PIECES[code][sq]
+        return code
+
+    def putCode(self, code, sq):
+        """Put back a piece returned by removePiece."""
+        if code != EMPTY:
+            color, ptype = divmod(code, 6)
+            self.addPiece(color, ptype, sq)
+
+    def movePiece(self, fromSq, toSq):
+        """Move a piece to an empty square."""
+        code = self.board[fromSq]
+        color, ptype = divmod(code, 6)
+        bits = (1 << fromSq) | (1 << toSq)
+        self.pieces[color][ptype] ^= bits
+        self.occupied[color] ^= bits
+        self.occupiedAll ^= bits
+        self.board[fromSq] = EMPTY
+        self.board[toSq] = code
+        keys = ZOBRIST_PIECES[code]
+        self.key ^= keys[fromSq] ^ keys[toSq]
+
+    def pieceAt(self, sq):
+        """Return (color, piece type) on a square or None."""
+        code = self.board[sq]
+        if code == EMPTY:
+            return None
+        return divmod(code, 6)
+
+    def kingSquare(self, color):
+        return self.pieces[color][KING].bit_length() - 1
+
+    def attacks(self, color):
+        """Bitboard of squares color attacks, seeing through the enemy king.
+        Built once per position; make() starts a fresh cache and unmake()
+        puts the previous one back, so repeated lookups cost nothing."""
+        attacked = self.attackMaps[color]
+        if attacked is None:
+            attacked = self.attackMaps[color] = attackMap(self, color)
+        return attacked
+
+    def inCheck(self, color=None):
+        """Whether color (default: the side to move) is in check."""
+        if color is None:
+            color = self.sideToMove
+        return self.attacks(color ^ 1) >> self.kingSquare(color) & 1 == 1
+
+    def legalMoves(self):
+        """Legal moves for the side to move as packed moves."""
+        return legalMoves(self, self.sideToMove)
+
+    def make(self, move):
+        """Play a packed move, including castling, en passant and promotion."""
+        fromSq = move & 63
+        toSq = (move >> 6) & 63
+        flag = move >> 12
+        board = self.board
+        code = board[fromSq]
+        color, ptype = divmod(code, 6)
+        key = self.key
+        captured = EMPTY
+        if flag & CAPTURE:
+            capSq = toSq if flag != EP_CAPTURE else (toSq + 8 if color == WHITE else toSq - 8)
+            captured = self.removePiece(capSq)
+        self.history.append((move, captured, self.castling, self.epSquare,
+                             self.halfmoveClock, key, self.attackMaps))
+        self.keyCounts[key] = self.keyCounts.get(key, 0) + 1
+        self.attackMaps = [None, None]
+        if captured != EMPTY or ptype == PAWN:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if color == BLACK:
+            self.fullmoveNumber += 1
+        self.sideToMove = color ^ 1
+        #the moving piece itself, done inline since this is the hot path
+        bits = (1 << fromSq) | (1 << toSq)
+        self.pieces[color][ptype] ^= bits
+        self.occupied[color] ^= bits
+        self.occupiedAll ^= bits
+        board[fromSq] = EMPTY
+        board[toSq] = code
+        keys = ZOBRIST_PIECES[code]
+        self.key ^= keys[fromSq] ^ keys[toSq] ^ ZOBRIST_SIDE
+        if flag & PROMOTION:
+            self.removePiece(toSq)
+            self.addPiece(color, KNIGHT + (flag & 3), toSq)
+        elif flag == KING_CASTLE:
+            self.movePiece(toSq + 1, toSq - 1)
+        elif flag == QUEEN_CASTLE:
+            self.movePiece(toSq - 2, toSq + 1)
+        castling = self.castling & CASTLE_KEEP[fromSq] & CASTLE_KEEP[toSq]
+        if castling != self.castling:
+            self.key ^= ZOBRIST_CASTLING[self.castling] ^ ZOBRIST_CASTLING[castling]
+            self.castling = castling
+        #only remember the en passant square if an enemy pawn could take there,
+        #so equal positions get equal keys
+        ep = -1
+        if flag == DOUBLE_PUSH:
+            ep = (fromSq + toSq) >> 1
+            if not PAWN_ATTACKS[color][ep] & self.pieces[color ^ 1][PAWN]:
+                ep = -1
+        if ep != self.epSquare:
+            self.key ^= ZOBRIST_EP[self.epSquare + 1] ^ ZOBRIST_EP[ep + 1]
+            self.epSquare = ep
+
+    def makeNull(self):
+        """Pass the turn without moving (for null-move pruning). The pieces
+        don't move, so the attack maps stay valid."""
+        self.history.append((NULL_MOVE, EMPTY, self.castling, self.epSquare,
+                             self.halfmoveClock, self.key, self.attackMaps))
+        self.key ^= ZOBRIST_SIDE ^ ZOBRIST_EP[self.epSquare + 1]
+        self.epSquare = -1
+        self.halfmoveClock += 1
+        self.sideToMove ^= 1
+
+    def unmakeNull(self):
+        """Take back a makeNull()."""
+        (move, captured, self.castling, self.epSquare,
+         self.halfmoveClock, self.key, self.attackMaps) = self.history.pop()
+        self.sideToMove ^= 1
+
+    def rewind(self, length):
+        """Take back moves and passed turns until the history is length
+        entries long, e.g. after a search was cut off mid-line. unmake()
+        can't take back a passed turn, so null moves need unmakeNull()."""
+        while len(self.history) > length:
+            if self.history[-1][0] == NULL_MOVE:
+                self.unmakeNull()
+            else:
+                self.unmake()
+
+    def unmake(self):
+        """Take back the last move played with make()."""
+        (move, captured, self.castling, self.epSquare,
+         self.halfmoveClock, key, self.attackMaps) = self.history.pop()
+        self.sideToMove ^= 1
+        if self.sideToMove == BLACK:
+            self.fullmoveNumber -= 1
+        fromSq = move & 63
+        toSq = (move >> 6) & 63
+        flag = move >> 12
+        if flag & PROMOTION:
+            color = self.board[toSq] // 6
+            self.removePiece(toSq)
+            self.addPiece(color, PAWN, toSq)
+        elif flag == KING_CASTLE:
+            self.movePiece(toSq - 1, toSq + 1)
+        elif flag == QUEEN_CASTLE:
+            self.movePiece(toSq + 1, toSq - 2)
+        board = self.board
+        code = board[toSq]
+        color, ptype = divmod(code, 6)
+        bits = (1 << fromSq) | (1 << toSq)
+        self.pieces[color][ptype] ^= bits
+        self.occupied[color] ^= bits
+        self.occupiedAll ^= bits
+        board[toSq] = EMPTY
+        board[fromSq] = code
+        if captured != EMPTY:
+            if flag == EP_CAPTURE:
+                toSq = toSq + 8 if captured // 6 == BLACK else toSq - 8
+            self.putCode(captured, toSq)
+        #the key from before the move, rather than undoing each change to it
+        self.key = key
+        count = self.keyCounts[key] - 1
+        if count:
+            self.keyCounts[key] = count
+        else:
+            del self.keyCounts[key]
+
+    def repetitions(self):
+        """How many times this position came up before in the history."""
+        return self.keyCounts.get(self.key, 0)
+
+FEN_PIECES = 'PNBRQKpnbrqk'
+FEN_CASTLING = (('K', CASTLE_WK), ('Q', CASTLE_WQ), ('k', CASTLE_BK), ('q', CASTLE_BQ))
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+def positionFromFen(fen):
+    """Build a Position from a FEN string."""
+    fields = fen.split()
+    position = Position()
+    for row, rank in enumerate(fields[0].split('/')):
+        col = 0
+        for char in rank:
+            if char.isdigit():
+                col += int(char)
+            else:
+                code = FEN_PIECES.index(char)
+                position.addPiece(code // 6, code % 6, square(row, col))
+                col += 1
+    position.sideToMove = WHITE if len(fields) < 2 or fields[1] == 'w' else BLACK
+    if len(fields) > 2:
+        for char, right in FEN_CASTLING:
+            if char in fields[2]:
+                position.castling |= right
+    if len(fields) > 3 and fields[3] != '-':
+        position.epSquare = square(8 - int(fields[3][1]), FILES.index(fields[3][0]))
+    if len(fields) > 5:
+        position.halfmoveClock = int(fields[4])
+        position.fullmoveNumber = int(fields[5])
+    position.key = zobristKey(position)
+    return position
+
+def zobristKey(position):
+    """Zobrist key of a position computed from scratch. Call this after
+    setting up a position field by field; make() and unmake() keep
+    position.key up to date on their own."""
+    key = ZOBRIST_CASTLING[position.castling] ^ ZOBRIST_EP[position.epSquare + 1]
+    if position.sideToMove == BLACK:
+        key ^= ZOBRIST_SIDE
+    for sq, code in enumerate(position.board):
+        if code != EMPTY:
+            key ^= ZOBRIST_PIECES[code][sq]
+    return key
+
+def material(position):
+    """Material balance from the bitboards. Positive favors white."""
+    value = 0
+    white, black = position.pieces
+    for ptype in range(5):
+        value += PIECE_VALUES[ptype] * (popcount(white[ptype]) - popcount(black[ptype]))
+    return value
+
+#piece steps and slider directions as (row, col) offsets
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (2, -1), (2, 1),
+                  (-1, -2), (1, -2), (-1, 2), (1, 2))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1),
+                (0, 1), (1, -1), (1, 0), (1, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+ROOK_DIRECTIONS = ((0, -1), (0, 1), (-1, 0), (1, 0))
+
+#per-square attack tables, built once at import
+
+def _stepTable(offsets):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        attacks = 0
+        for dr, dc in offsets:
+            r, c = row + dr, col + dc
+            if 0 <= r < 8 and 0 <= c < 8:
+                attacks |= 1 << (r*8 + c)
+        table.append(attacks)
+    return table
+
+KNIGHT_ATTACKS = _stepTable(KNIGHT_OFFSETS)
+KING_ATTACKS = _stepTable(KING_OFFSETS)
+#squares a pawn of each color attacks; white pawns move towards row 0
+PAWN_ATTACKS = [_stepTable(((-1, -1), (-1, 1))), _stepTable(((1, -1), (1, 1)))]
+
+#sliding attacks: for every square, the relevant blocker squares (its rays
+#without the board edge) and a table from each blocker subset to the full
+#attack set. Looking up occ & mask gives a slider's attacks in one step; the
+#dict does the job the multiply-and-shift hash does in magic bitboards.
+
+def _rayAttacks(sq, occ, directions):
+    row, col = divmod(sq, 8)
+    attacks = 0
+    for dr, dc in directions:
+        r, c = row + dr, col + dc
+        while 0 <= r < 8 and 0 <= c < 8:
+            attacks |= 1 << (r*8 + c)
+            if occ >> (r*8 + c) & 1:
+                break
+            r += dr
+            c += dc
+    return attacks
+
+def _blockerMask(sq, directions):
+    row, col = divmod(sq, 8)
+    mask = 0
+    for dr, dc in directions:
+        r, c = row + dr, col + dc
+        while 0 <= r + dr < 8 and 0 <= c + dc < 8:
+            mask |= 1 << (r*8 + c)
+            r += dr
+            c += dc
+    return mask
+
+def _slidingTables(directions):
+    masks = []
+    tables = []
+    for sq in range(64):
+        mask = _blockerMask(sq, directions)
+        table = {}
+        #walk every subset of the mask (carry-rippler)
+        subset = 0
+        while True:
+            table[subset] = _rayAttacks(sq, subset, directions)
+            subset = (subset - mask) & mask
+            if subset == 0:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+BISHOP_MASKS, BISHOP_TABLES = _slidingTables(BISHOP_DIRECTIONS)
+ROOK_MASKS, ROOK_TABLES = _slidingTables(ROOK_DIRECTIONS)
+
+def bishopAttacks(sq, occ):
+    return BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]]
+
+def rookAttacks(sq, occ):
+    return ROOK_TABLES[sq][occ & ROOK_MASKS[sq]]
+
+def queenAttacks(sq, occ):
+    return (BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]] |
+            ROOK_TABLES[sq][occ & ROOK_MASKS[sq]])
+
+def isAttacked(position, sq, byColor, occ=None, removed=0):
+    """True if any piece of byColor attacks the square. occ and removed let
+    callers test a move without making it: occ is the occupancy after the
+    move and removed has the bit of a captured attacker."""
+    if occ is None:
+        occ = position.occupiedAll
+    pieces = position.pieces[byColor]
+    if KNIGHT_ATTACKS[sq] & pieces[KNIGHT] & ~removed:
+        return True
+    #attacking pawns sit where a pawn of the other color on sq would capture
+    if PAWN_ATTACKS[byColor ^ 1][sq] & pieces[PAWN] & ~removed:
+        return True
+    if KING_ATTACKS[sq] & pieces[KING]:
+        return True
+    queens = pieces[QUEEN]
+    sliders = (pieces[BISHOP] | queens) & ~removed
+    if sliders and BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]] & sliders:
+        return True
+    sliders = (pieces[ROOK] | queens) & ~removed
+    if sliders and ROOK_TABLES[sq][occ & ROOK_MASKS[sq]] & sliders:
+        return True
+    return False
+
+NOT_FILE_A = FULL ^ sum(1 << square(row, 0) for row in range(8))
+NOT_FILE_H = FULL ^ sum(1 << square(row, 7) for row in range(8))
+
+def attackMap(position, color):
+    """All squares attacked by color. The other king is left out of the
+    occupancy so the squares behind it along a checking line count too."""
+    pieces = position.pieces[color]
+    occ = position.occupiedAll ^ position.pieces[color ^ 1][KING]
+    pawns = pieces[PAWN]
+    if color == WHITE:
+        attacked = ((pawns & NOT_FILE_A) >> 9) | ((pawns & NOT_FILE_H) >> 7)
+    else:
+        attacked = (((pawns & NOT_FILE_A) << 7) | ((pawns & NOT_FILE_H) << 9)) & FULL
+    attacked |= KING_ATTACKS[pieces[KING].bit_length() - 1] if pieces[KING] else 0
+    bb = pieces[KNIGHT]
+    while bb:
+        low = bb & -bb
+        bb ^= low
+        attacked |= KNIGHT_ATTACKS[low.bit_length() - 1]
+    bb = pieces[BISHOP] | pieces[QUEEN]
+    while bb:
+        low = bb & -bb
+        bb ^= low
+        sq = low.bit_length() - 1
+        attacked |= BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]]
+    bb = pieces[ROOK] | pieces[QUEEN]
+    while bb:
+        low = bb & -bb
+        bb ^= low
+        sq = low.bit_length() - 1
+        attacked |= ROOK_TABLES[sq][occ & ROOK_MASKS[sq]]
+    return attacked
+
+def attackersTo(position, sq, byColor, occ):
+    """Bitboard of the pieces of byColor attacking sq with the given occupancy."""
+    pieces = position.pieces[byColor]
+    queens = pieces[QUEEN]
+    return ((KNIGHT_ATTACKS[sq] & pieces[KNIGHT]) |
+            (PAWN_ATTACKS[byColor ^ 1][sq] & pieces[PAWN]) |
+            (KING_ATTACKS[sq] & pieces[KING]) |
+            (BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]] & (pieces[BISHOP] | queens)) |
+            (ROOK_TABLES[sq][occ & ROOK_MASKS[sq]] & (pieces[ROOK] | queens)))
+
+#squares strictly between two squares on a shared line, 0 if not aligned
+def _betweenTable():
+    table = [[0]*64 for _ in range(64)]
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        for dr, dc in BISHOP_DIRECTIONS + ROOK_DIRECTIONS:
+            r, c = row + dr, col + dc
+            between = 0
+            while 0 <= r < 8 and 0 <= c < 8:
+                table[sq][r*8 + c] = between
+                between |= 1 << (r*8 + c)
+                r += dr
+                c += dc
+    return table
+
+BETWEEN = _betweenTable()
+
+#(right, king square, rook square, squares that must be empty, squares the
+#king crosses, move) for each castle
+CASTLES = (
+    ((CASTLE_WK, 60, 63, (1 << 61) | (1 << 62), (61, 62), encodeMove(60, 62, KING_CASTLE)),
+     (CASTLE_WQ, 60, 56, (1 << 57) | (1 << 58) | (1 << 59), (59, 58), encodeMove(60, 58, QUEEN_CASTLE))),
+    ((CASTLE_BK, 4, 7, (1 << 5) | (1 << 6), (5, 6), encodeMove(4, 6, KING_CASTLE)),
+     (CASTLE_BQ, 4, 0, (1 << 1) | (1 << 2) | (1 << 3), (3, 2), encodeMove(4, 2, QUEEN_CASTLE))),
+)
+
+_CAPTURE = CAPTURE << 12
+#promotion flags, queen first so it is tried first
+_PROMOTIONS = tuple((PROMOTION + ptype - KNIGHT) << 12 for ptype in (QUEEN, ROOK, BISHOP, KNIGHT))
+_PROMOTION_CAPTURES = tuple(flag | _CAPTURE for flag in _PROMOTIONS)
+
+def legalMoves(position, color, capturesOnly=False):
+    """All legal moves for color as packed moves, or only the captures
+    (including en passant and capturing promotions) if capturesOnly is set.
+
+    Checkers and pinned pieces are found once for the position, so ordinary
+    moves are legal by construction. Only king moves and en passant are
+    verified by testing the square/occupancy they leave behind."""
+    them = color ^ 1
+    pieces = position.pieces[color]
+    enemyPieces = position.pieces[them]
+    own = position.occupied[color]
+    enemy = position.occupied[them]
+    occ = position.occupiedAll
+    kingSq = pieces[KING].bit_length() - 1
+    kingBit = 1 << kingSq
+    moves = []
+    append = moves.append
+
+    #the enemy attack map already looks through our king, so any king step
+    #onto an unattacked square is legal
+    danger = position.attacks(them)
+    #squares pieces may move to, before checks and pins are applied
+    reachable = enemy if capturesOnly else ~own
+    targets = KING_ATTACKS[kingSq] & reachable & ~danger
+    while targets:
+        low = targets & -targets
+        targets ^= low
+        append(kingSq | ((low.bit_length() - 1) << 6) | (_CAPTURE if low & enemy else 0))
+
+    checkers = attackersTo(position, kingSq, them, occ) if danger & kingBit else 0
+    if checkers & (checkers - 1):
+        #double check, only the king can move
+        return moves
+    if checkers:
+        checkMask = checkers | BETWEEN[kingSq][checkers.bit_length() - 1]
+    else:
+        checkMask = FULL
+        for right, fromSq, rookSq, empty, crossed, move in CASTLES[color]:
+            if (not capturesOnly and position.castling & right and fromSq == kingSq and
+                pieces[ROOK] >> rookSq & 1 and not occ & empty and
+                not danger >> crossed[0] & 1 and not danger >> crossed[1] & 1):
+                append(move)
+
+    #pins: an own piece alone between the king and an enemy slider on its line
+    pinned = 0
+    pinMasks = {}
+    snipers = ((ROOK_TABLES[kingSq][0] & (enemyPieces[ROOK] | enemyPieces[QUEEN])) |
+               (BISHOP_TABLES[kingSq][0] & (enemyPieces[BISHOP] | enemyPieces[QUEEN])))
+    while snipers:
+        low = snipers & -snipers
+        snipers ^= low
+        line = BETWEEN[kingSq][low.bit_length() - 1]
+        blockers = line & occ
+        if blockers & own and not blockers & (blockers - 1):
+            pinned |= blockers
+            pinMasks[blockers.bit_length() - 1] = line | low
+
+    allowed = checkMask & reachable
+    for ptype in (KNIGHT, BISHOP, ROOK, QUEEN):
+        bb = pieces[ptype]
+        while bb:
+            low = bb & -bb
+            bb ^= low
+            sq = low.bit_length() - 1
+            if ptype == KNIGHT:
+                if low & pinned:
+                    continue
+                targets = KNIGHT_ATTACKS[sq] & allowed
+            elif ptype == BISHOP:
+                targets = BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]] & allowed
+            elif ptype == ROOK:
+                targets = ROOK_TABLES[sq][occ & ROOK_MASKS[sq]] & allowed
+            else:
+                targets = ((BISHOP_TABLES[sq][occ & BISHOP_MASKS[sq]] |
+                            ROOK_TABLES[sq][occ & ROOK_MASKS[sq]]) & allowed)
+            if low & pinned:
+                targets &= pinMasks[sq]
+            while targets:
+                tlow = targets & -targets
+                targets ^= tlow
+                append(sq | ((tlow.bit_length() - 1) << 6) | (_CAPTURE if tlow & enemy else 0))
+
+    if color == WHITE:
+        step, startRow, lastRow = -8, 6, 1
+    else:
+        step, startRow, lastRow = 8, 1, 6
+    ep = position.epSquare
+    bb = pieces[PAWN]
+    while bb:
+        low = bb & -bb
+        bb ^= low
+        sq = low.bit_length() - 1
+        mask = (pinMasks[sq] if low & pinned else FULL) & checkMask
+        ahead = sq + step
+        row = sq >> 3
+        if row == lastRow:
+            if not capturesOnly and not occ >> ahead & 1 and mask >> ahead & 1:
+                for flag in _PROMOTIONS:
+                    append(sq | (ahead << 6) | flag)
+            hits = PAWN_ATTACKS[color][sq] & enemy & mask
+            while hits:
+                tlow = hits & -hits
+                hits ^= tlow
+                to = sq | ((tlow.bit_length() - 1) << 6)
+                for flag in _PROMOTION_CAPTURES:
+                    append(to | flag)
+            continue
+        if not capturesOnly and not occ >> ahead & 1:
+            if mask >> ahead & 1:
+                append(sq | (ahead << 6))
+            if row == startRow and not occ >> (ahead + step) & 1:
+                if mask >> (ahead + step) & 1:
+                    append(sq | ((ahead + step) << 6) | (DOUBLE_PUSH << 12))
+        hits = PAWN_ATTACKS[color][sq] & enemy & mask
+        while hits:
+            tlow = hits & -hits
+            hits ^= tlow
+            append(sq | ((tlow.bit_length() - 1) << 6) | _CAPTURE)
+        if ep >= 0 and PAWN_ATTACKS[color][sq] >> ep & 1:
+            #en passant clears two squares on one rank, so test it directly
+            victim = 1 << (ep - step)
+            after = (occ ^ low ^ victim) | (1 << ep)
+            if not isAttacked(position, kingSq, them, after, victim):
+                append(sq | (ep << 6) | (EP_CAPTURE << 12))
+    return moves
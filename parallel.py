@@ -0,0 +1,277 @@
+#Parallel search over a pool of worker processes, two ways:
+#
+#  root  The root moves of each iteration are shared out to the workers. The
+#        first (previously best) root move is searched here first to get a
+#        bound, then the rest go to the workers at once ("young brothers
+#        wait"). Workers get the position pickled (a couple of hundred bytes)
+#        and read the best root value so far from shared memory when they
+#        start a move, so later moves are searched with tighter bounds.
+#  lazy  Lazy SMP: every process searches the whole position and they share
+#        what they find through the transposition table.
+#
+#Either way all the processes use one search.SharedTranspositionTable, so a
+#position one of them has searched isn't searched again by the others.
+#
+#    python parallel.py                       speedup for 1, 2 and 4 workers
+#    python parallel.py -w 1 2 4 8 -d 6 -m lazy
+#                                             choose worker counts, depth, modes
+
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import engine
+import search
+
+#state shared with the worker processes; set by _initWorker
+_bestValue = None
+
+def _initWorker(bestValue, stop, tableName):
+    global _bestValue
+    _bestValue = bestValue
+    search.limits.stop = stop
+    search.table = search.SharedTranspositionTable(name=tableName)
+
+def _warmUp():
+    # Busy for a moment, so each worker of a batch takes one of these
+    time.sleep(0.05)
+    return os.getpid()
+
+def _startTask(deadline, maxNodes, age):
+    search.table.age = age
+    search.stats.reset()
+    search.limits.start(None if deadline is None else deadline - time.time(), maxNodes)
+
+def _searchRootMove(position, move, depth, deadline, maxNodes, age):
+    """Worker task: search one root move with a null window around the best
+    root value so far, and with the full window if it turns out better.
+    Returns (move, value, nodes, stats counters); value is None if the
+    budget ran out."""
+    white = position.sideToMove == engine.WHITE
+    bound = _bestValue.value
+    _startTask(deadline, maxNodes, age)
+    position.make(move)
+    try:
+        if white:
+            value = search.minimax(position, depth - 1, bound, bound + 1)
+            if value > bound:
+                value = search.minimax(position, depth - 1, bound, float('inf'))
+        else:
+            value = search.minimax(position, depth - 1, bound - 1, bound)
+            if value < bound:
+                value = search.minimax(position, depth - 1, float('-inf'), bound)
+    except search.SearchTimeout:
+        value = None
+    return move, value, search.limits.nodes, search.stats.counters()
+
+def _helperSearch(position, helper, deadline, maxNodes, maxDepth, age):
+    """Worker task for Lazy SMP: iterative deepening on the whole position
+    until stopped, only to fill the shared table. Every other helper runs
+    one ply ahead so the processes don't all search the same tree in step.
+    Returns the nodes searched and the stats counters."""
+    _startTask(deadline, maxNodes, age)
+    search.ordering.newSearch()
+    rootMoves = search.orderRootMoves(position, position.legalMoves())
+    bestValue = None
+    try:
+        for depth in range(1 + helper % 2, maxDepth + 1):
+            bestMove, bestValue = search.aspirationSearch(position, depth, rootMoves, bestValue)
+            rootMoves.remove(bestMove)
+            rootMoves.insert(0, bestMove)
+    except search.SearchTimeout:
+        pass
+    return search.limits.nodes, search.stats.counters()
+
+class ParallelSearch:
+    """A pool of worker processes that share a transposition table with
+    this one. start() launches the pool and waits until every worker is
+    up, so no search budget pays for starting processes; it is kept for
+    later searches and shutdown() stops it and frees the table."""
+    def __init__(self, workers, megabytes=16):
+        self.workers = workers
+        self.megabytes = megabytes
+        self.pool = None
+        self.table = None
+        #nodes searched by the last search, over all processes
+        self.nodes = 0
+
+    def start(self):
+        if self.pool is None:
+            #spawn rather than fork so workers never inherit the game window
+            context = multiprocessing.get_context('spawn')
+            self.bestValue = context.Value('d', 0.0, lock=False)
+            self.stop = context.Value('b', 0, lock=False)
+            self.table = search.SharedTranspositionTable(self.megabytes)
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=context,
+                                            initializer=_initWorker,
+                                            initargs=(self.bestValue, self.stop, self.table.name))
+            # Workers are spawned on demand; keep them busy until all have
+            # started and imported the engine
+            started = set()
+            while len(started) < self.workers:
+                futures = [self.pool.submit(_warmUp) for worker in range(self.workers)]
+                started.update(future.result() for future in futures)
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+            self.table.close()
+            self.table = None
+
+    def iterativeDeepening(self, position, maxTime=None, maxNodes=None, maxDepth=search.MAX_DEPTH):
+        """Parallel version of search.iterativeDeepening with the same budget
+        arguments; maxNodes applies to each process separately."""
+        if not position.legalMoves():
+            return None
+        self.start()
+        self.table.newSearch()
+        self.nodes = 0
+        # This process searches with the shared table too
+        ownTable = search.table
+        search.table = self.table
+        try:
+            return self.search(position, maxTime, maxNodes, maxDepth)
+        finally:
+            search.table = ownTable
+
+class RootSplitSearch(ParallelSearch):
+    """Root-parallel iterative deepening: each iteration searches the first
+    root move here, then the other root moves in the workers."""
+    def searchDepth(self, position, depth, rootMoves, deadline, maxNodes):
+        """One iteration. Returns (best move, value), or None if the budget
+        ran out."""
+        white = position.sideToMove == engine.WHITE
+        first = rootMoves[0]
+        search.limits.start(None if deadline is None else deadline - time.time(), maxNodes)
+        historyLength = len(position.history)
+        position.make(first)
+        try:
+            bestValue = search.minimax(position, depth - 1, float('-inf'), float('inf'))
+        except search.SearchTimeout:
+            position.rewind(historyLength)
+            return None
+        finally:
+            self.nodes += search.limits.nodes
+        position.unmake()
+        bestMove = first
+        self.bestValue.value = bestValue
+
+        futures = [self.pool.submit(_searchRootMove, position, move, depth, deadline,
+                                    maxNodes, self.table.age)
+                   for move in rootMoves[1:]]
+        finished = True
+        for future in as_completed(futures):
+            move, value, nodes, counters = future.result()
+            self.nodes += nodes
+            search.stats.add(counters)
+            if value is None:
+                finished = False
+                continue
+            if (value > bestValue) if white else (value < bestValue):
+                bestMove, bestValue = move, value
+                # Tasks that start from now on search with the new bound
+                self.bestValue.value = bestValue
+        if not finished:
+            return None
+        return bestMove, bestValue
+
+    def search(self, position, maxTime, maxNodes, maxDepth):
+        rootMoves = search.orderRootMoves(position, position.legalMoves())
+        bestMove = rootMoves[0]
+        search.ordering.newSearch()
+        search.stats.reset()
+        startTime = time.time()
+        deadline = None if maxTime is None else startTime + maxTime
+        for depth in range(1, maxDepth + 1):
+            result = self.searchDepth(position, depth, rootMoves, deadline, maxNodes)
+            if result is None:
+                break
+            bestMove, bestValue = result
+            search.stats.depthNodes.append(self.nodes)
+            rootMoves.remove(bestMove)
+            rootMoves.insert(0, bestMove)
+            if len(rootMoves) == 1 or abs(bestValue) >= search.MATE_SCORE:
+                break
+            if maxTime is not None and time.time() - startTime > maxTime / 2:
+                break
+        search.stats.nodes = self.nodes
+        return bestMove
+
+class LazySMPSearch(ParallelSearch):
+    """Lazy SMP: this process runs the normal iterative deepening search
+    while every worker searches the same position at the same time. They
+    only cooperate through the shared table, where the workers' results
+    cut the main search's tree short. The main search's move is played."""
+    def search(self, position, maxTime, maxNodes, maxDepth):
+        deadline = None if maxTime is None else time.time() + maxTime
+        self.stop.value = 0
+        futures = [self.pool.submit(_helperSearch, position, helper, deadline, maxNodes,
+                                    maxDepth, self.table.age)
+                   for helper in range(self.workers)]
+        try:
+            bestMove = search.iterativeDeepening(position, maxTime, maxNodes, maxDepth)
+            self.nodes += search.limits.nodes
+        finally:
+            self.stop.value = 1
+            for future in futures:
+                nodes, counters = future.result()
+                self.nodes += nodes
+                search.stats.add(counters)
+        search.stats.nodes = self.nodes
+        return bestMove
+
+#parallel searches by name, for search.setWorkers and the report
+MODES = {'lazy': LazySMPSearch, 'root': RootSplitSearch}
+
+#positions used for the speedup report
+BENCHMARK_FENS = (
+    engine.START_FEN,
+    'r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4',
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+)
+
+def benchmark(workerCounts, depth, modes):
+    """Time a fixed-depth search of the benchmark positions for each mode
+    and worker count and print the speedup over the single-process search."""
+    search.table.clear()
+    start = time.perf_counter()
+    nodes = 0
+    for fen in BENCHMARK_FENS:
+        search.iterativeDeepening(engine.positionFromFen(fen), maxDepth=depth)
+        nodes += search.limits.nodes
+    serial = time.perf_counter() - start
+    print(f'serial            {serial:7.2f}s  {nodes:>9} nodes')
+    for mode in modes:
+        for workers in workerCounts:
+            searcher = MODES[mode](workers)
+            searcher.start()
+            # Warm up so process start-up isn't timed
+            searcher.iterativeDeepening(engine.positionFromFen(engine.START_FEN), maxDepth=1)
+            searcher.table.clear()
+            start = time.perf_counter()
+            nodes = 0
+            for fen in BENCHMARK_FENS:
+                searcher.iterativeDeepening(engine.positionFromFen(fen), maxDepth=depth)
+                nodes += searcher.nodes
+            elapsed = time.perf_counter() - start
+            searcher.shutdown()
+            print(f'{mode:<4} {workers:>2} workers  {elapsed:7.2f}s  {nodes:>9} nodes  '
+                  f'speedup {serial / elapsed:.2f}x')
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel search speedup report')
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help='worker counts to try')
+    parser.add_argument('-d', '--depth', type=int, default=5, help='search depth')
+    parser.add_argument('-m', '--mode', nargs='+', choices=sorted(MODES),
+                        default=sorted(MODES), help='parallel searches to try')
+    args = parser.parse_args()
+    print(f'{multiprocessing.cpu_count()} cores, depth {args.depth}')
+    benchmark(args.workers, args.depth, args.mode)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#Perft: counts the leaf nodes of the legal move tree to a fixed depth and
+#compares them against published reference counts. Any bug in move generation
+#(castling, en passant, promotion, pins, checks) shows up as a wrong count.
+#
+#    python perft.py                      run the whole suite
+#    python perft.py -d 4                 run the suite to depth 4
+#    python perft.py -p kiwipete --divide per-move breakdown for one position
+#    python perft.py --fen "<fen>" -d 3   any position
+
+import argparse
+import time
+
+import engine
+
+#name: (fen, node counts for depth 1, 2, ...)
+POSITIONS = {
+    'start': (engine.START_FEN,
+              (20, 400, 8902, 197281, 4865609)),
+    #castling through/out of check, pins, promotions
+    'kiwipete': ('r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                 (48, 2039, 97862, 4085603)),
+    #en passant discovered checks along the rank
+    'endgame': ('8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+                (14, 191, 2812, 43238, 674624)),
+    #promotions with capture, castling rights lost to captures
+    'promotion': ('r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                  (6, 264, 9467, 422333)),
+    'talkchess': ('rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+                  (44, 1486, 62379, 2103487)),
+    'middlegame': ('r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+                   (46, 2079, 89890, 3894594)),
+}
+
+#depth used by the suite when none is given, kept to a few seconds each
+DEFAULT_DEPTH = {'start': 4, 'kiwipete': 3, 'endgame': 5, 'promotion': 4,
+                 'talkchess': 3, 'middlegame': 3}
+
+def perft(position, depth):
+    """Number of leaf nodes depth plies below position."""
+    moves = position.legalMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        position.make(move)
+        nodes += perft(position, depth - 1)
+        position.unmake()
+    return nodes
+
+def divide(position, depth):
+    """Leaf counts below each root move, as a list of (move, nodes)."""
+    counts = []
+    for move in position.legalMoves():
+        position.make(move)
+        counts.append((move, perft(position, depth - 1) if depth > 1 else 1))
+        position.unmake()
+    return counts
+
+def run(name, fen, depth, expected=None, showDivide=False):
+    """Run perft on one position and print the result. Returns (ok, nodes):
+    whether the count matches the reference (or there is no reference),
+    and the count itself."""
+    position = engine.positionFromFen(fen)
+    start = time.perf_counter()
+    if showDivide:
+        counts = divide(position, depth)
+        nodes = sum(count for move, count in counts)
+    else:
+        nodes = perft(position, depth)
+    elapsed = time.perf_counter() - start
+    if showDivide:
+        for move, count in sorted(counts, key=lambda item: engine.moveName(item[0])):
+            print(f'  {engine.moveName(move)}: {count}')
+    ok = expected is None or nodes == expected
+    status = '' if expected is None else ('ok' if ok else f'FAIL (expected {expected})')
+    nps = nodes / elapsed if elapsed > 0 else 0
+    print(f'{name:<11} depth {depth}  {nodes:>9} nodes  {elapsed:7.2f}s  {nps:>9,.0f} nps  {status}')
+    return ok, nodes
+
+def main():
+    parser = argparse.ArgumentParser(description='Perft move generation test')
+    parser.add_argument('-d', '--depth', type=int, help='search depth')
+    parser.add_argument('-p', '--position', choices=sorted(POSITIONS), help='run one suite position')
+    parser.add_argument('--fen', help='run an arbitrary position')
+    parser.add_argument('--divide', action='store_true', help='print the count below each root move')
+    args = parser.parse_args()
+
+    if args.fen:
+        run('fen', args.fen, args.depth or 3, showDivide=args.divide)
+        return
+    names = [args.position] if args.position else list(POSITIONS)
+    failures = 0
+    totalNodes = 0
+    totalTime = time.perf_counter()
+    for name in names:
+        fen, counts = POSITIONS[name]
+        depth = args.depth or DEFAULT_DEPTH[name]
+        expected = counts[depth - 1] if depth <= len(counts) else None
+        ok, nodes = run(name, fen, depth, expected, args.divide)
+        if not ok:
+            failures += 1
+        totalNodes += nodes
+    totalTime = time.perf_counter() - totalTime
+    if len(names) > 1:
+        print(f'total {totalNodes} nodes in {totalTime:.2f}s, {totalNodes / totalTime:,.0f} nps')
+    print('all counts match' if not failures else f'{failures} position(s) FAILED')
+    raise SystemExit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,936 @@
+#Computer player search. Everything here works on an engine.Position and never
+#sees the UI, so a search can be run on a copy of the game position from
+#anywhere (a worker thread, another process, a script).
+
+from array import array
+import json
+import random
+import threading
+import time
+from multiprocessing import shared_memory, util
+
+import engine
+
+#checkmate score; anything at least this big is a forced mate
+MATE_SCORE = 1000
+#deepest iteration iterativeDeepening will start
+MAX_DEPTH = 64
+#plies the move ordering tables cover
+MAX_PLY = MAX_DEPTH + 1
+
+#half width of the root window around the previous iteration's value, in pawns
+ASPIRATION_WINDOW = 1
+
+#delta pruning margin in quiescence search, in pawns
+DELTA_MARGIN = 2
+
+#null-move pruning searches the position after a pass this much shallower
+NULL_MOVE_REDUCTION = 2
+#late move reductions apply from this depth, after this many moves
+LMR_MIN_DEPTH = 3
+LMR_MOVES = 3
+
+#transposition table bound types
+EXACT, LOWER, UPPER = 0, 1, 2
+
+#scores are stored offset so they fit an unsigned field
+SCORE_OFFSET = 1 << 19
+
+class TranspositionTable:
+    """Fixed-size hash table of search results keyed by Zobrist key.
+
+    Each slot is two 64-bit words: the full key, and the data packed as
+    move (16 bits) | score (20) | depth (8) | bound (2) | age (8), so the
+    table never grows past its memory budget. A slot is overwritten when the
+    new result is at least as deep, or when the old one is from an earlier
+    search (depth-preferred replacement with aging)."""
+    def __init__(self, megabytes=16):
+        self.resize(megabytes)
+
+    def resize(self, megabytes):
+        entries = 1
+        while entries * 2 * 16 <= megabytes * (1 << 20):
+            entries *= 2
+        self.mask = entries - 1
+        self.keys = array('Q', bytes(8 * entries))
+        self.data = array('Q', bytes(8 * entries))
+        self.age = 0
+
+    def clear(self):
+        entries = self.mask + 1
+        self.keys = array('Q', bytes(8 * entries))
+        self.data = array('Q', bytes(8 * entries))
+
+    def newSearch(self):
+        """Start a new search; entries from older searches become replaceable."""
+        self.age = (self.age + 1) & 255
+
+    def probe(self, key):
+        """Return (move, score, depth, bound) stored for key, or None."""
+        index = key & self.mask
+        if self.keys[index] != key:
+            return None
+        data = self.data[index]
+        return (data & 0xffff, (data >> 16 & 0xfffff) - SCORE_OFFSET,
+                data >> 36 & 255, data >> 44 & 3)
+
+    def store(self, key, move, score, depth, bound):
+        index = key & self.mask
+        old = self.data[index]
+        if self.keys[index] == key or depth >= (old >> 36 & 255) or (old >> 46) != self.age:
+            self.keys[index] = key
+            self.data[index] = (move | (score + SCORE_OFFSET) << 16 | depth << 36 |
+                                bound << 44 | self.age << 46)
+
+class SharedTranspositionTable(TranspositionTable):
+    """Transposition table in shared memory that several processes search
+    with at once. Same data word as TranspositionTable, but slot i is the
+    pair (key ^ data, data) at words 2i and 2i+1 of the block, so there are
+    no locks: a slot torn by two processes writing it at the same time fails
+    the key check and reads as a miss (lockless hashing).
+
+    The process that creates the table owns the block and unlinks it in
+    close(); others attach with SharedTranspositionTable(name=...)."""
+    def __init__(self, megabytes=16, name=None):
+        self.memory = None
+        # The block can't be closed while slots is alive, so release it
+        # first when the process exits
+        util.Finalize(self, self.close, exitpriority=0)
+        if name is None:
+            self.resize(megabytes)
+        else:
+            self.attach(shared_memory.SharedMemory(name=name), False)
+
+    def attach(self, memory, owner):
+        self.memory = memory
+        self.owner = owner
+        self.slots = memory.buf.cast('Q')
+        self.mask = len(self.slots) // 2 - 1
+        self.name = memory.name
+        self.age = 0
+
+    def resize(self, megabytes):
+        entries = 1
+        while entries * 2 * 16 <= megabytes * (1 << 20):
+            entries *= 2
+        self.close()
+        self.attach(shared_memory.SharedMemory(create=True, size=16 * entries), True)
+
+    def clear(self):
+        self.memory.buf[:] = bytes(len(self.memory.buf))
+
+    def close(self):
+        """Detach from the block, and free it if this process made it."""
+        if self.memory is not None:
+            self.slots.release()
+            self.memory.close()
+            if self.owner:
+                self.memory.unlink()
+            self.memory = None
+
+    def probe(self, key):
+        index = (key & self.mask) << 1
+        data = self.slots[index + 1]
+        if self.slots[index] ^ data != key:
+            return None
+        return (data & 0xffff, (data >> 16 & 0xfffff) - SCORE_OFFSET,
+                data >> 36 & 255, data >> 44 & 3)
+
+    def store(self, key, move, score, depth, bound):
+        index = (key & self.mask) << 1
+        old = self.slots[index + 1]
+        if (self.slots[index] ^ old == key or depth >= (old >> 36 & 255) or
+                (old >> 46) != self.age):
+            data = (move | (score + SCORE_OFFSET) << 16 | depth << 36 |
+                    bound << 44 | self.age << 46)
+            self.slots[index] = key ^ data
+            self.slots[index + 1] = data
+
+#shared by every search so results carry over from move to move
+table = TranspositionTable()
+tableMegabytes = 16
+
+def setTableSize(megabytes):
+    """Set the transposition table's memory budget (clears it)."""
+    global tableMegabytes
+    tableMegabytes = megabytes
+    table.resize(megabytes)
+
+#most pawns of random noise added to evaluations to weaken the play (set by
+#searchMove); each position gets the same noise all through one search.
+#Each search draws a new seed and it is mixed into the transposition table
+#keys too, so scores stored under one seed are never read under another
+noise = 0
+noiseSeed = 0
+NOISE_MULTIPLIER = 0x9E3779B97F4A7C15
+
+def evaluatePosition(position):
+    """Evaluate the position. Positive favors white, negative favors black."""
+    # Material values only, counted straight from the bitboards
+    value = engine.material(position)
+    if noise:
+        mixed = ((position.key ^ noiseSeed) * NOISE_MULTIPLIER & engine.FULL) >> 32
+        value += mixed % (2 * noise + 1) - noise
+    return value
+
+def captureValue(position, move):
+    """Material value of the piece a move captures (0 for non-captures)."""
+    if not (move >> 12) & engine.CAPTURE:
+        return 0
+    captured = position.board[(move >> 6) & 63]
+    # en passant lands on an empty square and takes a pawn
+    if captured == engine.EMPTY:
+        return engine.PIECE_VALUES[engine.PAWN]
+    return engine.PIECE_VALUES[captured % 6]
+
+#capture ordering score by [victim][attacker] type: most valuable victim
+#first, then least valuable attacker
+MVV_LVA = [[engine.PIECE_VALUES[victim] * 8 + engine.KING - attacker
+            for attacker in range(6)] for victim in range(6)]
+
+#material a pawn gains by promoting to a queen
+PROMOTION_GAIN = engine.PIECE_VALUES[engine.QUEEN] - engine.PIECE_VALUES[engine.PAWN]
+
+#piece values for exchanges; the king's is big enough that taking it ends one
+EXCHANGE_VALUES = engine.PIECE_VALUES[:engine.KING] + (100,)
+
+def staticExchange(position, move):
+    """Material the side to move comes out with after a capture and every
+    recapture on its square, each side capturing with its least valuable
+    piece and free to stop when going on would lose. Negative for a
+    losing capture such as a queen taking a defended pawn."""
+    fromSq = move & 63
+    to = (move >> 6) & 63
+    board = position.board
+    pieces = position.pieces
+    occ = position.occupiedAll ^ (1 << fromSq)
+    captured = board[to]
+    if move >> 12 == engine.EP_CAPTURE:
+        # The pawn taken en passant is beside the target square
+        occ ^= 1 << (to + (8 if position.sideToMove == engine.WHITE else -8))
+        gains = [EXCHANGE_VALUES[engine.PAWN]]
+    elif captured == engine.EMPTY:
+        gains = [0]
+    else:
+        gains = [EXCHANGE_VALUES[captured % 6]]
+    onSquare = EXCHANGE_VALUES[board[fromSq] % 6]
+    if move >> 12 & engine.PROMOTION:
+        promoted = engine.KNIGHT + (move >> 12 & 3)
+        gains[0] += EXCHANGE_VALUES[promoted] - EXCHANGE_VALUES[engine.PAWN]
+        onSquare = EXCHANGE_VALUES[promoted]
+    side = position.sideToMove ^ 1
+    while True:
+        # Attackers are found again each time so pieces behind the ones
+        # that have captured join in
+        attackers = engine.attackersTo(position, to, side, occ) & occ
+        if not attackers:
+            break
+        for ptype in range(6):
+            bits = attackers & pieces[side][ptype]
+            if bits:
+                break
+        gain = onSquare - gains[-1]
+        # Ahead if it stops here, and capturing back wouldn't make up for
+        # it even unanswered: the other side stops
+        if max(-gains[-1], gain) < 0:
+            break
+        gains.append(gain)
+        occ ^= bits & -bits
+        onSquare = EXCHANGE_VALUES[ptype]
+        side ^= 1
+    # Each side picks the better of capturing or stopping, from the end back
+    for index in range(len(gains) - 1, 0, -1):
+        gains[index - 1] = -max(-gains[index - 1], gains[index])
+    return gains[0]
+
+def losingCapture(position, move):
+    """True if a capture loses material once the exchange is played out.
+    Taking a piece at least as valuable as the capturer never does, and
+    neither does one on a square the opponent doesn't attack (the attack
+    map inCheck uses, already built by move generation)."""
+    board = position.board
+    to = (move >> 6) & 63
+    captured = board[to]
+    if captured != engine.EMPTY and (engine.PIECE_VALUES[captured % 6] >=
+                                     engine.PIECE_VALUES[board[move & 63] % 6]):
+        return False
+    if not position.attacks(position.sideToMove ^ 1) >> to & 1:
+        return False
+    return staticExchange(position, move) < 0
+
+def quiescence(position, alpha, beta):
+    """Capture-only search run at the horizon so exchanges are played out
+    before evaluating. White maximizes, black minimizes."""
+    limits.nodes += 1
+    stats.qnodes += 1
+    if limits.nodes >= limits.checkAt:
+        limits.check()
+    
+    # Stand pat: the side to move doesn't have to capture
+    standPat = evaluatePosition(position)
+    white = position.sideToMove == engine.WHITE
+    if white:
+        if standPat >= beta:
+            return standPat
+        alpha = max(alpha, standPat)
+    else:
+        if standPat <= alpha:
+            return standPat
+        beta = min(beta, standPat)
+    
+    captures = engine.legalMoves(position, position.sideToMove, True)
+    board = position.board
+    moveScores = []
+    for move in captures:
+        value = captureValue(position, move)
+        promotion = move >> 12 & engine.PROMOTION
+        if promotion:
+            value += PROMOTION_GAIN
+        # Delta pruning: skip captures that can't bring the score back
+        # into the window even with a margin to spare
+        if white:
+            if standPat + value + DELTA_MARGIN <= alpha:
+                continue
+        elif standPat - value - DELTA_MARGIN >= beta:
+            continue
+        # Nor can captures that lose material once the exchange is played out
+        if losingCapture(position, move):
+            continue
+        # Most valuable victim first, then least valuable attacker, with a
+        # capturing promotion (the only kind generated here) ahead of a
+        # plain capture of the same piece
+        victim = engine.PAWN if move >> 12 == engine.EP_CAPTURE else board[(move >> 6) & 63] % 6
+        score = MVV_LVA[victim][board[move & 63] % 6]
+        if promotion:
+            score += PROMOTION_GAIN * 8
+        moveScores.append((score, move))
+    moveScores.sort(reverse=True, key=lambda x: x[0])
+    
+    bestEval = standPat
+    for value, move in moveScores:
+        position.make(move)
+        eval = quiescence(position, alpha, beta)
+        position.unmake()
+        if white:
+            if eval > bestEval:
+                bestEval = eval
+            alpha = max(alpha, eval)
+        else:
+            if eval < bestEval:
+                bestEval = eval
+            beta = min(beta, eval)
+        if beta <= alpha:
+            break
+    return bestEval
+
+#move ordering score bands; a move's score is packed above its 16 bits so
+#a plain integer sort puts the best moves first
+HASH_MOVE_SCORE = 1 << 30
+PROMOTION_SCORE = (1 << 28) + (1 << 8)
+CAPTURE_SCORE = 1 << 28
+KILLER_SCORE = 1 << 27
+HISTORY_LIMIT = 1 << 26
+#losing captures go after every quiet move
+LOSING_CAPTURE_SCORE = -(1 << 8)
+
+class MoveOrdering:
+    """Killer moves for each ply and a from/to history table, kept for the
+    whole search, plus one reusable sort buffer per ply.
+
+    Order: the transposition table move, promotions and captures that
+    don't lose material (by MVV_LVA), the two killers of this ply, quiet
+    moves by how often they caused cutoffs, then losing captures."""
+    __slots__ = ('killers', 'history', 'buffers')
+
+    def __init__(self):
+        self.killers = [[0, 0] for ply in range(MAX_PLY)]
+        self.history = [0]*4096
+        self.buffers = [[] for ply in range(MAX_PLY)]
+
+    def newSearch(self):
+        """Forget the killers and age the history scores."""
+        for killers in self.killers:
+            killers[0] = killers[1] = 0
+        history = self.history
+        for index in range(4096):
+            history[index] >>= 1
+
+    def order(self, position, moves, ply, hashMove):
+        """Sort moves into this ply's buffer and return it. Each entry is
+        score << 16 | move, so the move is entry & 0xffff."""
+        buffer = self.buffers[ply]
+        buffer.clear()
+        append = buffer.append
+        board = position.board
+        killer1, killer2 = self.killers[ply]
+        history = self.history
+        for move in moves:
+            if move == hashMove:
+                score = HASH_MOVE_SCORE
+            elif move >= QUIET_LIMIT:
+                victim = board[(move >> 6) & 63]
+                if move >> 12 & engine.PROMOTION:
+                    score = PROMOTION_SCORE
+                    if victim != engine.EMPTY:
+                        score += MVV_LVA[victim % 6][engine.PAWN]
+                else:
+                    # en passant lands on an empty square and takes a pawn
+                    victim = engine.PAWN if victim == engine.EMPTY else victim % 6
+                    score = MVV_LVA[victim][board[move & 63] % 6]
+                    score += LOSING_CAPTURE_SCORE if losingCapture(position, move) else CAPTURE_SCORE
+            elif move == killer1:
+                score = KILLER_SCORE + 1
+            elif move == killer2:
+                score = KILLER_SCORE
+            else:
+                score = history[move & 4095]
+            append(score << 16 | move)
+        buffer.sort(reverse=True)
+        return buffer
+
+    def cutoff(self, move, ply, depth):
+        """Record a quiet move that caused a beta cutoff."""
+        if move >= QUIET_LIMIT:
+            return
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        index = move & 4095
+        self.history[index] += depth * depth
+        if self.history[index] >= HISTORY_LIMIT:
+            history = self.history
+            for other in range(4096):
+                history[other] >>= 1
+
+#moves at or above this are captures or promotions
+QUIET_LIMIT = engine.CAPTURE << 12
+#ordered entries below this are quiet moves that are neither the hash move
+#nor a killer, and losing captures; late move reductions only touch the
+#quiet ones
+LMR_SCORE_LIMIT = KILLER_SCORE << 16
+
+def hasPieces(position, color):
+    """Whether color has anything besides pawns and its king."""
+    pieces = position.pieces[color]
+    return bool(pieces[engine.KNIGHT] | pieces[engine.BISHOP] |
+                pieces[engine.ROOK] | pieces[engine.QUEEN])
+
+ordering = MoveOrdering()
+
+def minimax(position, depth, alpha, beta, ply=1):
+    """Minimax algorithm with alpha-beta pruning and move ordering.
+    White maximizes, black minimizes. ply is the distance from the root."""
+    limits.nodes += 1
+    if limits.nodes >= limits.checkAt:
+        limits.check()
+    # A position seen before in the game or on this line is a draw: whoever
+    # could do better wouldn't have let it repeat
+    if position.key in position.keyCounts:
+        return 0
+    if depth == 0:
+        return quiescence(position, alpha, beta)
+    
+    # Probe the transposition table before generating any moves
+    key = position.key ^ noiseSeed
+    entry = table.probe(key)
+    stats.ttProbes += 1
+    hashMove = 0
+    if entry is not None:
+        stats.ttHits += 1
+        hashMove, score, entryDepth, bound = entry
+        if entryDepth >= depth:
+            if bound == EXACT:
+                return score
+            if bound == LOWER:
+                alpha = max(alpha, score)
+            else:
+                beta = min(beta, score)
+            if alpha >= beta:
+                return score
+    originalAlpha, originalBeta = alpha, beta
+    
+    isMaximizing = position.sideToMove == engine.WHITE
+    inCheck = position.inCheck()
+    
+    # Null-move pruning: if passing still leaves the opponent unable to
+    # get back inside the window, a real move surely would too. Skipped in
+    # check, in principal variation nodes, right after another null move,
+    # and when the side to move has only pawns (zugzwang is common there).
+    if (depth > NULL_MOVE_REDUCTION and not inCheck and beta - alpha <= 1 and
+        position.history and position.history[-1][0] != engine.NULL_MOVE and
+        hasPieces(position, position.sideToMove)):
+        position.makeNull()
+        if isMaximizing:
+            eval = minimax(position, depth - 1 - NULL_MOVE_REDUCTION, beta - 1, beta, ply + 1)
+        else:
+            eval = minimax(position, depth - 1 - NULL_MOVE_REDUCTION, alpha, alpha + 1, ply + 1)
+        position.unmakeNull()
+        if (eval >= beta) if isMaximizing else (eval <= alpha):
+            return eval
+    
+    validMoves = position.legalMoves()
+    
+    if not validMoves:
+        # Check if it's checkmate or stalemate
+        if position.inCheck():
+            return -MATE_SCORE if isMaximizing else MATE_SCORE  # Checkmate
+        else:
+            return 0  # Stalemate
+    
+    orderedMoves = ordering.order(position, validMoves, ply, hashMove)
+    
+    # Principal variation search: the first move gets the full window, the
+    # rest only have to prove they are no better with a null window, and
+    # are searched again if they are. Late quiet moves are first searched
+    # a ply shallower (late move reductions).
+    bestMove = orderedMoves[0] & 0xffff
+    canReduce = depth >= LMR_MIN_DEPTH and not inCheck
+    searched = 0
+    if isMaximizing:
+        bestEval = float('-inf')
+        for entry in orderedMoves:
+            move = entry & 0xffff
+            position.make(move)
+            if searched == 0:
+                eval = minimax(position, depth - 1, alpha, beta, ply + 1)
+            else:
+                reduction = 0
+                if (canReduce and searched >= LMR_MOVES and entry < LMR_SCORE_LIMIT and
+                    move < QUIET_LIMIT and not position.inCheck()):
+                    reduction = 1
+                eval = minimax(position, depth - 1 - reduction, alpha, alpha + 1, ply + 1)
+                if reduction and eval > alpha:
+                    eval = minimax(position, depth - 1, alpha, alpha + 1, ply + 1)
+                if alpha < eval < beta:
+                    eval = minimax(position, depth - 1, alpha, beta, ply + 1)
+            position.unmake()
+            searched += 1
+            
+            if eval > bestEval:
+                bestEval = eval
+                bestMove = move
+            alpha = max(alpha, eval)
+            if beta <= alpha:
+                stats.cutoffs += 1
+                if searched == 1:
+                    stats.firstMoveCutoffs += 1
+                ordering.cutoff(move, ply, depth)
+                break  # Alpha-beta pruning
+    else:
+        bestEval = float('inf')
+        for entry in orderedMoves:
+            move = entry & 0xffff
+            position.make(move)
+            if searched == 0:
+                eval = minimax(position, depth - 1, alpha, beta, ply + 1)
+            else:
+                reduction = 0
+                if (canReduce and searched >= LMR_MOVES and entry < LMR_SCORE_LIMIT and
+                    move < QUIET_LIMIT and not position.inCheck()):
+                    reduction = 1
+                eval = minimax(position, depth - 1 - reduction, beta - 1, beta, ply + 1)
+                if reduction and eval < beta:
+                    eval = minimax(position, depth - 1, beta - 1, beta, ply + 1)
+                if alpha < eval < beta:
+                    eval = minimax(position, depth - 1, alpha, beta, ply + 1)
+            position.unmake()
+            searched += 1
+            
+            if eval < bestEval:
+                bestEval = eval
+                bestMove = move
+            beta = min(beta, eval)
+            if beta <= alpha:
+                stats.cutoffs += 1
+                if searched == 1:
+                    stats.firstMoveCutoffs += 1
+                ordering.cutoff(move, ply, depth)
+                break  # Alpha-beta pruning
+    
+    if bestEval <= originalAlpha:
+        bound = UPPER
+    elif bestEval >= originalBeta:
+        bound = LOWER
+    else:
+        bound = EXACT
+    table.store(key, bestMove, bestEval, depth, bound)
+    return bestEval
+
+class SearchTimeout(Exception):
+    """Raised inside the search once its time or node budget is used up."""
+
+class SearchLimits:
+    """Node count and budget of the search in progress."""
+    __slots__ = ('nodes', 'maxNodes', 'deadline', 'softDeadline', 'checkAt',
+                 'stop', 'pondering')
+
+    #nodes between clock checks
+    CHECK_INTERVAL = 1024
+
+    def __init__(self):
+        #flag another thread or process can set to end the search early
+        #(anything with a value attribute, e.g. a multiprocessing.Value)
+        self.stop = None
+        #while set the clock is ignored; see Ponderer
+        self.pondering = False
+        self.start(None, None)
+
+    def start(self, maxTime, maxNodes):
+        self.nodes = 0
+        self.maxNodes = maxNodes
+        if maxTime is None:
+            self.deadline = self.softDeadline = None
+        else:
+            now = time.perf_counter()
+            self.deadline = now + maxTime
+            # The next iteration takes several times longer than the last;
+            # past this point don't start one that has no chance of finishing
+            self.softDeadline = now + maxTime / 2
+        self.checkAt = self.CHECK_INTERVAL if maxNodes is None else min(self.CHECK_INTERVAL, maxNodes)
+
+    def check(self):
+        """Called by the search every so often; raises when out of budget."""
+        if self.maxNodes is not None and self.nodes >= self.maxNodes:
+            raise SearchTimeout()
+        if (self.deadline is not None and not self.pondering and
+                time.perf_counter() >= self.deadline):
+            raise SearchTimeout()
+        if self.stop is not None and self.stop.value:
+            raise SearchTimeout()
+        self.checkAt = self.nodes + self.CHECK_INTERVAL
+        if self.maxNodes is not None:
+            self.checkAt = min(self.checkAt, self.maxNodes)
+
+    def softTimeUp(self):
+        """True once there is no point starting another iteration."""
+        return (self.softDeadline is not None and not self.pondering and
+                time.perf_counter() > self.softDeadline)
+
+limits = SearchLimits()
+
+class SearchStats:
+    """What the last search cost. The counters are bumped by minimax and
+    quiescence; iterativeDeepening resets them and records the node count
+    after each depth it finishes. The parallel searches add in the workers'
+    counters, so every figure covers all the processes. After a ponder hit
+    ms is the time from the hit to the answer, and ponderMs the time spent
+    pondering before it."""
+    __slots__ = ('nodes', 'qnodes', 'ttProbes', 'ttHits', 'cutoffs', 'firstMoveCutoffs',
+                 'depthNodes', 'startTime', 'replyTime')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        #all nodes, quiescence included, set when the search ends
+        self.nodes = 0
+        self.qnodes = self.ttProbes = self.ttHits = 0
+        self.cutoffs = self.firstMoveCutoffs = 0
+        #total nodes when each depth finished
+        self.depthNodes = []
+        self.startTime = time.perf_counter()
+        #when the move was asked for: the start, or the ponder hit
+        self.replyTime = self.startTime
+
+    def counters(self):
+        """The counters other than nodes, to send back from a worker."""
+        return self.qnodes, self.ttProbes, self.ttHits, self.cutoffs, self.firstMoveCutoffs
+
+    def add(self, counters):
+        """Add in a worker's counters()."""
+        qnodes, ttProbes, ttHits, cutoffs, firstMoveCutoffs = counters
+        self.qnodes += qnodes
+        self.ttProbes += ttProbes
+        self.ttHits += ttHits
+        self.cutoffs += cutoffs
+        self.firstMoveCutoffs += firstMoveCutoffs
+
+    def report(self):
+        """The figures as a dict."""
+        nodes = self.nodes
+        now = time.perf_counter()
+        searchMs = (now - self.startTime) * 1000
+        depthNodes = self.depthNodes
+        # Effective branching factor: how many times more nodes the last
+        # finished depth took than the one before
+        ebf = None
+        if len(depthNodes) >= 2:
+            previous = depthNodes[-2] - (depthNodes[-3] if len(depthNodes) >= 3 else 0)
+            if previous:
+                ebf = round((depthNodes[-1] - depthNodes[-2]) / previous, 2)
+        return {
+            'depth': len(depthNodes),
+            'nodes': nodes,
+            'qnodes': self.qnodes,
+            'ttProbes': self.ttProbes,
+            'ttHits': self.ttHits,
+            'cutoffs': self.cutoffs,
+            'firstMoveCutoffRate': round(self.firstMoveCutoffs / self.cutoffs, 3) if self.cutoffs else None,
+            'ebf': ebf,
+            'ms': round((now - self.replyTime) * 1000, 1),
+            'ponderMs': round((self.replyTime - self.startTime) * 1000, 1),
+            'nps': round(nodes * 1000 / searchMs) if searchMs else None,
+        }
+
+stats = SearchStats()
+
+def orderRootMoves(position, validMoves):
+    """Order root moves: captures that don't lose material first (by
+    MVV_LVA), then quiet moves by piece value, then losing captures."""
+    board = position.board
+    moveScores = []
+    for move in validMoves:
+        # Add piece value for move ordering
+        score = engine.PIECE_VALUES[board[move & 63] % 6]
+        if captureValue(position, move):
+            # en passant lands on an empty square and takes a pawn
+            victim = engine.PAWN if move >> 12 == engine.EP_CAPTURE else board[(move >> 6) & 63] % 6
+            score = MVV_LVA[victim][board[move & 63] % 6]
+            score += -100 if losingCapture(position, move) else 100
+        moveScores.append((score, move))
+    moveScores.sort(reverse=True, key=lambda x: x[0])
+    return [m[1] for m in moveScores]
+
+def searchRoot(position, depth, rootMoves, alpha=float('-inf'), beta=float('inf')):
+    """Search every root move to depth plies inside (alpha, beta).
+    Returns (best move, value); a value outside the window is only a bound."""
+    white = position.sideToMove == engine.WHITE
+    bestMove = rootMoves[0]
+    bestValue = None
+    for move in rootMoves:
+        position.make(move)
+        # The best value so far bounds the rest of the root moves, which
+        # get a null window first as in minimax
+        if bestValue is None:
+            value = minimax(position, depth - 1, alpha, beta)
+        elif white:
+            value = minimax(position, depth - 1, alpha, alpha + 1)
+            if alpha < value < beta:
+                value = minimax(position, depth - 1, alpha, beta)
+        else:
+            value = minimax(position, depth - 1, beta - 1, beta)
+            if alpha < value < beta:
+                value = minimax(position, depth - 1, alpha, beta)
+        position.unmake()
+        if white:
+            if bestValue is None or value > bestValue:
+                bestValue, bestMove = value, move
+                alpha = max(alpha, value)
+        else:
+            if bestValue is None or value < bestValue:
+                bestValue, bestMove = value, move
+                beta = min(beta, value)
+        if alpha >= beta:
+            break
+    return bestMove, bestValue
+
+def aspirationSearch(position, depth, rootMoves, previousValue):
+    """Search the root in a narrow window around the previous iteration's
+    value, widening to the full window only if the result falls outside."""
+    if previousValue is None or abs(previousValue) >= MATE_SCORE:
+        return searchRoot(position, depth, rootMoves)
+    alpha, beta = previousValue - ASPIRATION_WINDOW, previousValue + ASPIRATION_WINDOW
+    bestMove, bestValue = searchRoot(position, depth, rootMoves, alpha, beta)
+    if alpha < bestValue < beta:
+        return bestMove, bestValue
+    return searchRoot(position, depth, rootMoves)
+
+def iterativeDeepening(position, maxTime=None, maxNodes=None, maxDepth=MAX_DEPTH):
+    """Search depth 1, 2, 3... until the time (seconds) or node budget runs
+    out, and return the best move of the last iteration that finished.
+    Each iteration searches the previous best move first, and the
+    transposition table orders the moves below the root."""
+    rootMoves = position.legalMoves()
+    if not rootMoves:
+        return None
+    rootMoves = orderRootMoves(position, rootMoves)
+    bestMove = rootMoves[0]
+    limits.start(maxTime, maxNodes)
+    stats.reset()
+    ordering.newSearch()
+    historyLength = len(position.history)
+    bestValue = None
+    for depth in range(1, maxDepth + 1):
+        try:
+            bestMove, bestValue = aspirationSearch(position, depth, rootMoves, bestValue)
+        except SearchTimeout:
+            # Take back whatever the unfinished iteration had made
+            position.rewind(historyLength)
+            break
+        stats.depthNodes.append(limits.nodes)
+        rootMoves.remove(bestMove)
+        rootMoves.insert(0, bestMove)
+        if len(rootMoves) == 1 or abs(bestValue) >= MATE_SCORE:
+            break
+        if limits.softTimeUp():
+            break
+    stats.nodes = limits.nodes
+    return bestMove
+
+#worker processes helping the search; they share one transposition table
+#with this process (see parallel.py for the modes)
+workers = 0
+parallelMode = 'lazy'
+parallelSearch = None
+
+def setWorkers(count, mode='lazy'):
+    """Set how many worker processes help the search (0 for none), and how
+    it splits the work with them ('lazy' or 'root'). The workers are started
+    here, so the first search doesn't spend its time budget on that."""
+    global workers, parallelMode, parallelSearch, lastTable
+    if parallelSearch is not None:
+        parallelSearch.shutdown()
+        parallelSearch = None
+        lastTable = None
+    workers = max(0, count)
+    parallelMode = mode
+    if workers:
+        import parallel
+        parallelSearch = parallel.MODES[parallelMode](workers, tableMegabytes)
+        parallelSearch.start()
+
+#the table the last searchMove filled: the workers' shared one or this one
+lastTable = None
+
+def searchMove(position, maxNodes=None, maxMs=None, maxDepth=MAX_DEPTH, noise=0):
+    """Pick a move by iterative deepening within a budget: at most maxNodes
+    nodes, maxMs milliseconds and maxDepth plies (None for no limit), with
+    up to noise pawns of random error in every evaluation. Returns None if
+    there are no legal moves."""
+    global parallelSearch, lastTable
+    setNoise(noise)
+    maxTime = None if maxMs is None else maxMs / 1000
+    if maxDepth is None:
+        maxDepth = MAX_DEPTH
+    # The workers evaluate without noise, so only exact searches use them
+    if workers and not noise:
+        if parallelSearch is None:
+            import parallel
+            parallelSearch = parallel.MODES[parallelMode](workers, tableMegabytes)
+        move = parallelSearch.iterativeDeepening(position, maxTime, maxNodes, maxDepth)
+        lastTable = parallelSearch.table
+        return move
+    lastTable = table
+    return iterativeDeepening(position, maxTime, maxNodes, maxDepth)
+
+def setNoise(pawns):
+    """Set the evaluation noise, with fresh random values for each position."""
+    global noise, noiseSeed
+    noise = pawns
+    # 0 keeps exact searches on the plain keys, shared with the workers
+    noiseSeed = random.getrandbits(64) if pawns else 0
+
+#searchMove budget for each difficulty. The time limit is the worst case:
+#the clock is checked every CHECK_INTERVAL nodes, a few milliseconds apart
+PRESETS = {
+    'easy': {'maxNodes': 1000, 'maxMs': 100, 'maxDepth': 1, 'noise': 2},
+    'medium': {'maxNodes': 20000, 'maxMs': 250, 'maxDepth': 3, 'noise': 1},
+    'hard': {'maxMs': 1000},
+}
+
+class StopFlag:
+    """Stop flag for SearchLimits.stop within one process."""
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = False
+
+class Ponderer:
+    """Thinks on the opponent's time. After the computer moves, start()
+    guesses the reply from the transposition table and searches the
+    position after it in a background thread, with the clock ignored.
+    If the guess is played, hit() starts the clock as if the search had
+    begun when pondering did and waits for the result; otherwise stop()
+    throws the search away. Either way whatever it stored in the
+    transposition table stays there for the next search."""
+    def __init__(self):
+        self.thread = None
+        self.key = None
+        self.result = None
+        self.flag = StopFlag()
+
+    def start(self, position, difficulty):
+        """Ponder on a copy of the game position, opponent to move."""
+        self.stop()
+        # The expected reply is the best move stored for the position the
+        # computer's search left behind
+        entry = (lastTable or table).probe(position.key ^ noiseSeed)
+        if entry is None or entry[0] not in position.legalMoves():
+            return
+        position.make(entry[0])
+        self.key = position.key
+        self.result = None
+        self.flag.value = False
+        limits.stop = self.flag
+        limits.pondering = True
+        table.newSearch()
+        self.thread = threading.Thread(target=self.run, args=(position, PRESETS[difficulty]),
+                                       daemon=True)
+        self.thread.start()
+
+    def run(self, position, budget):
+        # searchMove without the workers, whose clocks can't be stopped
+        setNoise(budget.get('noise', 0))
+        maxMs = budget.get('maxMs')
+        maxDepth = budget.get('maxDepth')
+        self.result = iterativeDeepening(position, None if maxMs is None else maxMs / 1000,
+                                         budget.get('maxNodes'),
+                                         MAX_DEPTH if maxDepth is None else maxDepth)
+
+    def hit(self):
+        """The guessed reply was played: finish the search within its budget
+        and return its move."""
+        stats.replyTime = time.perf_counter()
+        limits.pondering = False
+        self.thread.join()
+        self.thread = None
+        limits.stop = None
+        return self.result
+
+    def stop(self):
+        """Abandon pondering, if it is running."""
+        if self.thread is not None:
+            self.flag.value = True
+            self.thread.join()
+            self.thread = None
+            limits.stop = None
+            limits.pondering = False
+
+ponderer = Ponderer()
+
+#called with the stats report of every search chooseMove runs
+statsCallback = None
+#JSON-lines file the reports are appended to, if set
+statsLog = None
+
+def setStatsCallback(callback):
+    global statsCallback
+    statsCallback = callback
+
+def setStatsLog(path):
+    global statsLog
+    statsLog = path
+
+def chooseMove(position, difficulty):
+    """Pick a packed move for the side to move, or None if it has no moves.
+    The position is left as it was."""
+    move = None
+    if ponderer.thread is not None:
+        if ponderer.key == position.key:
+            move = ponderer.hit()
+        else:
+            ponderer.stop()
+    if move is None:
+        table.newSearch()
+        move = searchMove(position, **PRESETS[difficulty])
+    if move is not None and (statsCallback is not None or statsLog):
+        report = stats.report()
+        report['difficulty'] = difficulty
+        report['move'] = engine.moveName(move)
+        if statsCallback is not None:
+            statsCallback(report)
+        if statsLog:
+            with open(statsLog, 'a') as log:
+                log.write(json.dumps(report) + '\n')
+    return move
@@ -0,0 +1,441 @@
+#Endgame tablebases: for every position of a small ending (three or four
+#pieces counting the kings) whether the side to move wins, draws or loses,
+#and in how many plies it mates or gets mated. The tables are generated here
+#by retrograde analysis (working backwards from the checkmates), saved in
+#tablebase.bin, and memory-mapped when the game needs them.
+#
+#A table holds one byte per position: 0 draw, 1 impossible position, and
+#otherwise 2 + the number of plies to mate with best play, even when the side
+#to move gets mated and odd when it mates. Tables are named for the material,
+#stronger side first, and hold positions with that side as white; the other
+#way round is looked up by mirroring the board. Castling, en passant and the
+#fifty move rule are left out.
+#
+#    python tablebase.py                  build the three piece tables
+#    python tablebase.py KQvKR KRvKB      build four piece tables too (slow)
+#    python tablebase.py --fen "<fen>"    look up a position
+
+import argparse
+import mmap
+import os
+import struct
+import time
+
+import engine
+from engine import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
+
+TABLEBASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebase.bin')
+
+#built by default; KBvK and KNvK are draws and need no table
+DEFAULT_TABLES = ('KQvK', 'KRvK', 'KPvK')
+
+#most pieces a table can have, kings included
+MAX_PIECES = 4
+
+DRAW, ILLEGAL = 0, 1
+
+PIECE_LETTERS = 'PNBRQK'
+#order of the pieces besides the king within a table name
+ORDER = 'QRBNP'
+
+#file layout: magic, table count, then a (name, offset, size) directory
+MAGIC = b'TBS1'
+HEADER = struct.Struct('<4sI')
+DIRECTORY_ENTRY = struct.Struct('<8sQQ')
+
+def sideKey(letters):
+    """Sort key for one side's pieces; the bigger side goes first in names."""
+    return (sum(engine.PIECE_VALUES[PIECE_LETTERS.index(letter)] for letter in letters),
+            len(letters), [-ORDER.index(letter) for letter in letters])
+
+def tableName(white, black):
+    """Name of the table holding a material balance, e.g. ('R', 'Q') -> 'KQvKR'."""
+    white = ''.join(sorted(white, key=ORDER.index))
+    black = ''.join(sorted(black, key=ORDER.index))
+    if sideKey(black) > sideKey(white):
+        white, black = black, white
+    return 'K' + white + 'vK' + black
+
+def insufficient(white, black):
+    """True for material that can't mate: bare kings or a single minor piece."""
+    pieces = white + black
+    return len(pieces) <= 1 and all(letter in 'BN' for letter in pieces)
+
+class Layout:
+    """How the positions of one table are numbered. A position is the side
+    to move, then the squares of the white king, the black king and the
+    other pieces in name order. Mirroring puts the white king on the a-d
+    files, and with no pawns also on ranks 1-4, so every position has one
+    number and the table is a quarter (or half) the size."""
+    def __init__(self, name):
+        white, black = name[1:].split('vK')
+        self.name = name
+        self.pieces = ((WHITE, KING), (BLACK, KING)) + tuple(
+            (color, PIECE_LETTERS.index(letter))
+            for color, letters in ((WHITE, white), (BLACK, black)) for letter in letters)
+        self.pawns = 'P' in name
+        self.kingSquares = [sq for sq in range(64) if sq & 7 < 4 and (self.pawns or sq >= 32)]
+        self.kingSlot = [-1]*64
+        for slot, sq in enumerate(self.kingSquares):
+            self.kingSlot[sq] = slot
+        self.stride = 64 ** (len(self.pieces) - 1)
+        self.sideSize = len(self.kingSquares) * self.stride
+        self.size = 2 * self.sideSize
+
+    def index(self, sideToMove, squares):
+        flip = 7 if squares[0] & 7 >= 4 else 0
+        if not self.pawns and squares[0] < 32:
+            flip |= 56
+        index = self.kingSlot[squares[0] ^ flip]
+        for sq in squares[1:]:
+            index = index * 64 + (sq ^ flip)
+        return sideToMove * self.sideSize + index
+
+    def squares(self, index):
+        """(side to move, squares) of a position number."""
+        sideToMove, index = divmod(index, self.sideSize)
+        squares = []
+        for _ in range(len(self.pieces) - 1):
+            index, sq = divmod(index, 64)
+            squares.append(sq)
+        squares.append(self.kingSquares[index])
+        squares.reverse()
+        return sideToMove, squares
+
+def _attacks(color, ptype, sq, occ):
+    if ptype == PAWN:
+        return engine.PAWN_ATTACKS[color][sq]
+    if ptype == KNIGHT:
+        return engine.KNIGHT_ATTACKS[sq]
+    if ptype == BISHOP:
+        return engine.bishopAttacks(sq, occ)
+    if ptype == ROOK:
+        return engine.rookAttacks(sq, occ)
+    if ptype == QUEEN:
+        return engine.queenAttacks(sq, occ)
+    return engine.KING_ATTACKS[sq]
+
+def _attacked(pieces, squares, sq, byColor, occ):
+    """True if a piece of byColor attacks sq; captured pieces have square -1."""
+    for (color, ptype), at in zip(pieces, squares):
+        if color == byColor and at >= 0 and _attacks(color, ptype, at, occ) >> sq & 1:
+            return True
+    return False
+
+def _legal(pieces, squares, sideToMove):
+    """True if the squares are a position that can happen in a game."""
+    occ = 0
+    for (color, ptype), sq in zip(pieces, squares):
+        if occ >> sq & 1 or (ptype == PAWN and sq >> 3 in (0, 7)):
+            return False
+        occ |= 1 << sq
+    # The side that just moved can't have left its king in check
+    return not _attacked(pieces, squares, squares[sideToMove ^ 1], sideToMove, occ)
+
+def _children(pieces, squares, sideToMove):
+    """The positions after each legal move, as (pieces, squares, stays):
+    stays is False when a capture or promotion takes it to another table,
+    and then captured pieces are dropped from the lists."""
+    occ = own = 0
+    for (color, ptype), sq in zip(pieces, squares):
+        occ |= 1 << sq
+        if color == sideToMove:
+            own |= 1 << sq
+    children = []
+    for i, ((color, ptype), sq) in enumerate(zip(pieces, squares)):
+        if color != sideToMove:
+            continue
+        if ptype == PAWN:
+            step = -8 if color == WHITE else 8
+            targets = engine.PAWN_ATTACKS[color][sq] & occ & ~own
+            if not occ >> (sq + step) & 1:
+                targets |= 1 << (sq + step)
+                if sq >> 3 == (6 if color == WHITE else 1) and not occ >> (sq + 2*step) & 1:
+                    targets |= 1 << (sq + 2*step)
+        else:
+            targets = _attacks(color, ptype, sq, occ) & ~own
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            to = bit.bit_length() - 1
+            after = list(squares)
+            after[i] = to
+            captured = squares.index(to) if occ & bit else -1
+            if captured >= 0:
+                after[captured] = -1
+            if _attacked(pieces, after, after[sideToMove], sideToMove ^ 1, occ & ~(1 << sq) | bit):
+                continue
+            if ptype == PAWN and to >> 3 in (0, 7):
+                for promoted in (QUEEN, ROOK, BISHOP, KNIGHT):
+                    newPieces = list(pieces)
+                    newPieces[i] = (color, promoted)
+                    children.append(_dropCaptured(newPieces, after) + (False,))
+            elif captured >= 0:
+                children.append(_dropCaptured(pieces, after) + (False,))
+            else:
+                children.append((pieces, after, True))
+    return children
+
+def _dropCaptured(pieces, squares):
+    return ([piece for piece, sq in zip(pieces, squares) if sq >= 0],
+            [sq for sq in squares if sq >= 0])
+
+def _parents(layout, squares, sideToMove):
+    """Numbers of the positions that reach this one by a move that neither
+    captures nor promotes (some may be impossible positions)."""
+    mover = sideToMove ^ 1
+    occ = 0
+    for sq in squares:
+        occ |= 1 << sq
+    parents = []
+    for i, ((color, ptype), sq) in enumerate(zip(layout.pieces, squares)):
+        if color != mover:
+            continue
+        if ptype == PAWN:
+            back = 8 if color == WHITE else -8
+            origins = 0
+            if (sq + back) >> 3 not in (0, 7) and not occ >> (sq + back) & 1:
+                origins = 1 << (sq + back)
+                if sq >> 3 == (4 if color == WHITE else 3) and not occ >> (sq + 2*back) & 1:
+                    origins |= 1 << (sq + 2*back)
+        else:
+            origins = _attacks(color, ptype, sq, occ) & ~occ
+        while origins:
+            bit = origins & -origins
+            origins ^= bit
+            before = list(squares)
+            before[i] = bit.bit_length() - 1
+            parents.append(layout.index(mover, before))
+    return parents
+
+class Tablebase:
+    """The tables in memory (while generating) or mapped from the file."""
+    def __init__(self):
+        #name: (layout, bytes-like table)
+        self.tables = {}
+        self.mapped = None
+
+    def load(self, path=TABLEBASE_PATH):
+        """Map the tables in a file."""
+        with open(path, 'rb') as file:
+            self.mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = HEADER.unpack_from(self.mapped, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a tablebase file')
+        view = memoryview(self.mapped)
+        for n in range(count):
+            name, offset, size = DIRECTORY_ENTRY.unpack_from(
+                self.mapped, HEADER.size + n * DIRECTORY_ENTRY.size)
+            name = name.rstrip(b'\0').decode()
+            self.tables[name] = (Layout(name), view[offset:offset + size])
+
+    def save(self, path=TABLEBASE_PATH):
+        names = sorted(self.tables)
+        offset = HEADER.size + len(names) * DIRECTORY_ENTRY.size
+        directory = []
+        for name in names:
+            size = len(self.tables[name][1])
+            directory.append(DIRECTORY_ENTRY.pack(name.encode(), offset, size))
+            offset += size
+        with open(path, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, len(names)))
+            file.write(b''.join(directory))
+            for name in names:
+                file.write(self.tables[name][1])
+
+    def value(self, pieces, squares, sideToMove):
+        """Table byte of a position given as (color, type) pieces and their
+        squares, or None if no table covers it. Bare kings and a lone
+        minor piece are draws."""
+        letters = ([], [])
+        for color, ptype in pieces:
+            if ptype != KING:
+                letters[color].append(PIECE_LETTERS[ptype])
+        white = ''.join(sorted(letters[WHITE], key=ORDER.index))
+        black = ''.join(sorted(letters[BLACK], key=ORDER.index))
+        if insufficient(white, black):
+            return DRAW
+        name = tableName(white, black)
+        if name not in self.tables:
+            return None
+        layout, table = self.tables[name]
+        # The table has the stronger side as white; otherwise swap colors
+        # and mirror the ranks
+        swap = 0 if name == 'K' + white + 'vK' + black else 1
+        flip = 56 if swap else 0
+        # Kings first, then the other pieces in name order
+        placed = sorted((ptype != KING, color ^ swap,
+                         ORDER.index(PIECE_LETTERS[ptype]) if ptype != KING else 0, sq ^ flip)
+                        for (color, ptype), sq in zip(pieces, squares))
+        return table[layout.index(sideToMove ^ swap, [piece[3] for piece in placed])]
+
+    def build(self, name, log=print):
+        """Generate a table, and first any table its captures and
+        promotions lead to that isn't there yet."""
+        if name in self.tables:
+            return
+        layout = Layout(name)
+        pieces = layout.pieces
+        log(f'{name}: {layout.size} positions')
+        start = time.perf_counter()
+        values = bytearray(layout.size)
+        #moves that stay in the table and haven't been shown to lose yet
+        counts = bytearray(layout.size)
+        #a loss can be no shorter than this, from moves leaving the table;
+        #SAFE when a move leaving the table draws or wins
+        SAFE = 255
+        floors = bytearray(layout.size)
+        #positions to settle at each ply count, shortest first
+        levels = [[] for _ in range(254)]
+        for index in range(layout.size):
+            sideToMove, squares = layout.squares(index)
+            if not _legal(pieces, squares, sideToMove):
+                values[index] = ILLEGAL
+                continue
+            children = _children(pieces, squares, sideToMove)
+            if not children:
+                if _attacked(pieces, squares, squares[sideToMove], sideToMove ^ 1,
+                             sum(1 << sq for sq in squares)):
+                    levels[0].append(index)
+                # Otherwise stalemate, which stays a draw
+                continue
+            count = floor = 0
+            win = None
+            for childPieces, childSquares, stays in children:
+                if stays:
+                    count += 1
+                    continue
+                value = self.value(childPieces, childSquares, sideToMove ^ 1)
+                if value is None:
+                    white = ''.join(PIECE_LETTERS[ptype] for color, ptype in childPieces
+                                    if color == WHITE and ptype != KING)
+                    black = ''.join(PIECE_LETTERS[ptype] for color, ptype in childPieces
+                                    if color == BLACK and ptype != KING)
+                    self.build(tableName(white, black), log)
+                    value = self.value(childPieces, childSquares, sideToMove ^ 1)
+                if value == DRAW:
+                    floor = SAFE
+                elif (value - 2) % 2 == 0:
+                    # The opponent gets mated: a win
+                    floor = SAFE
+                    win = value - 1 if win is None else min(win, value - 1)
+                elif floor != SAFE:
+                    floor = max(floor, value - 1)
+            if win is not None:
+                levels[win].append(index)
+            elif count == 0 and floor != SAFE:
+                levels[floor].append(index)
+            counts[index] = count
+            floors[index] = floor
+
+        for level, positions in enumerate(levels):
+            for index in positions:
+                if values[index]:
+                    continue
+                values[index] = level + 2
+                sideToMove, squares = layout.squares(index)
+                for parent in _parents(layout, squares, sideToMove):
+                    if values[parent]:
+                        continue
+                    if level % 2 == 0:
+                        # Moving here mates the side to move in level plies
+                        levels[level + 1].append(parent)
+                    else:
+                        counts[parent] -= 1
+                        if counts[parent] == 0 and floors[parent] != SAFE:
+                            levels[max(level + 1, floors[parent])].append(parent)
+        self.tables[name] = (layout, values)
+        log(f'{name}: done in {time.perf_counter() - start:.1f}s, longest mate '
+            f'{max(level for level, positions in enumerate(levels) if positions)} plies')
+
+    def probe(self, position):
+        """Table byte for an engine Position, or None if it isn't covered.
+        Castling rights are ignored: the tables are built without castling,
+        which is only a detour for the side that can still do it, and
+        bestMove looks at castling moves one ply deep."""
+        if engine.popcount(position.occupiedAll) > MAX_PIECES or position.epSquare != -1:
+            return None
+        pieces = []
+        squares = []
+        for sq, code in enumerate(position.board):
+            if code != engine.EMPTY:
+                pieces.append((code // 6, code % 6))
+                squares.append(sq)
+        return self.value(pieces, squares, position.sideToMove)
+
+    def bestMove(self, position):
+        """The move that mates fastest, holds the draw, or loses slowest,
+        or None if some move leads out of the tables."""
+        if self.probe(position) is None:
+            return None
+        bestMove = bestScore = None
+        for move in position.legalMoves():
+            position.make(move)
+            value = self.probe(position)
+            position.unmake()
+            if value is None:
+                return None
+            if value == DRAW:
+                score = 0
+            elif (value - 2) % 2 == 0:
+                score = 1000 - value
+            else:
+                score = value - 1000
+            if bestScore is None or score > bestScore:
+                bestMove, bestScore = move, score
+        return bestMove
+
+def describe(value, sideToMove):
+    if value is None:
+        return 'not in the tables'
+    if value == DRAW:
+        return 'draw'
+    if value == ILLEGAL:
+        return 'impossible position'
+    plies = value - 2
+    winner = sideToMove if plies % 2 else sideToMove ^ 1
+    return f'{engine.COLOR_NAMES[winner]} mates in {(plies + 1) // 2} moves ({plies} plies)'
+
+#the tables are mapped on first use
+tablebase = None
+
+def tablebaseMove(position):
+    """A perfect move for a position with few pieces left, or None when the
+    tables don't cover it (also when there is no tablebase file)."""
+    global tablebase
+    if engine.popcount(position.occupiedAll) > MAX_PIECES:
+        return None
+    if tablebase is None:
+        if not os.path.exists(TABLEBASE_PATH):
+            return None
+        tablebase = Tablebase()
+        tablebase.load()
+    return tablebase.bestMove(position)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the endgame tablebases')
+    parser.add_argument('tables', nargs='*', help='tables to build besides the defaults, e.g. KQvKR')
+    parser.add_argument('--fen', help='look up this position')
+    args = parser.parse_args()
+    tables = Tablebase()
+    if os.path.exists(TABLEBASE_PATH):
+        tables.load()
+    if args.fen:
+        position = engine.positionFromFen(args.fen)
+        print(describe(tables.probe(position), position.sideToMove))
+        move = tables.bestMove(position)
+        if move is not None:
+            print('best move', engine.moveName(move))
+        return
+    for name in DEFAULT_TABLES + tuple(args.tables):
+        white, black = name[1:].split('vK')
+        if len(name) - 1 > MAX_PIECES:
+            parser.error(f'{name} has more than {MAX_PIECES} pieces')
+        tables.build(tableName(white, black))
+    # Copy the mapped tables before the file is written over
+    tables.tables = {name: (layout, bytes(table)) for name, (layout, table) in tables.tables.items()}
+    tables.save()
+    print(f'{len(tables.tables)} tables written to {TABLEBASE_PATH}')
+
+if __name__ == '__main__':
+    main()